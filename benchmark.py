@@ -0,0 +1,230 @@
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import resource
+import tempfile
+import time
+import graphs
+import hmm
+import segmentation
+import transitional_frequencies
+import trigram_hmm
+from corpus import join_words, read_corpus
+
+# This benchmarks the cost of each segmentation method: training time, model load time,
+# throughput and per-sentence latency on a fixed slice of EVBCorpus and on a large synthetic corpus, and peak memory.
+# Each method is trained in one fresh process and loaded and decoded in another,
+# so that the peak memory of serving a model is its own, without training or making the synthetic corpus.
+# Both peaks are reported, though the training peak does not count the workers of a parallel trainer.
+# A method is benchmarked by giving it a trainer here, which trains a model on some SGML files, saves it, and returns the file to load it from.
+# Loading and decoding go through segmentation.py.
+
+def train_maximal_matching(filenames, model_filename, options):
+    return options['dictionary']
+
+def train_hmm(filenames, model_filename, options):
+    model = hmm.HMM()
+
+    for syllables, actual_boundaries in read_corpus(filenames, cache=True):
+        model.train(syllables, actual_boundaries)
+
+    model.estimate()
+    model.save(model_filename)
+    return model_filename
+
+def train_trigram_hmm(filenames, model_filename, options):
+    model = trigram_hmm.TrigramHMM()
+
+    for syllables, actual_boundaries in read_corpus(filenames, cache=True):
+        model.train(syllables, actual_boundaries)
+
+    model.estimate()
+    model.save(model_filename)
+    return model_filename
+
+def train_graphs(filenames, model_filename, options):
+    model = graphs.BigramModel()
+
+    for syllables, actual_boundaries in read_corpus(filenames, cache=True):
+        model.train(join_words(syllables, actual_boundaries))
+
+    model.save(model_filename)
+    return model_filename
+
+# Transitional frequencies are trained on raw sentences, so without a news corpus, the SGML sentences are used without their annotations.
+
+def train_transitional_frequencies(filenames, model_filename, options):
+    if options['news']:
+        model = transitional_frequencies.train_parallel(options['news'])
+
+    else:
+        model = transitional_frequencies.TransitionalModel()
+
+        for syllables, actual_boundaries in read_corpus(filenames, cache=True):
+            model.train(syllables)
+
+    model.save(model_filename)
+    return model_filename
+
+trainers = {
+    'maximal_matching': train_maximal_matching,
+    'hmm': train_hmm,
+    'trigram_hmm': train_trigram_hmm,
+    'graphs': train_graphs,
+    'transitional_frequencies': train_transitional_frequencies,
+    'hybrid_graphs': train_graphs,
+    'hybrid_hmm': train_hmm
+}
+
+# Here, we make a synthetic corpus by drawing words of the training data at random, with a fixed seed so that runs are comparable.
+# It is written to a file, one sentence per line, so that decoding can read it a sentence at a time.
+
+def write_synthetic_corpus(filenames, size, filename, seed=0):
+    words = sorted({word for syllables, actual_boundaries in read_corpus(filenames, cache=True) for word in join_words(syllables, actual_boundaries)})
+    generator = random.Random(seed)
+
+    with open(filename, 'w') as file:
+        for _ in range(size):
+            file.write(' '.join(generator.choices(words, k=generator.randint(5, 40))) + '\n')
+
+def read_synthetic_corpus(filename):
+    with open(filename, 'r') as file:
+        for line in file:
+            yield line.split()
+
+# Here, we get the peak resident set size of this process in kilobytes.
+# On Linux, it is read from /proc, since ru_maxrss of a new process also counts the process it was started from.
+
+def peak_rss_kb():
+    if os.path.exists('/proc/self/status'):
+        with open('/proc/self/status', 'r') as file:
+            for line in file:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def percentile(values, fraction):
+    return values[min(int(fraction * len(values)), len(values) - 1)] if values else None
+
+def measure(method, model, sentences):
+    latencies = []
+    syllable_count = 0
+    start = time.perf_counter()
+
+    for syllables in sentences:
+        sentence_start = time.perf_counter()
+        segmentation.posit_boundaries(method, model, syllables)
+        latencies.append(time.perf_counter() - sentence_start)
+        syllable_count += len(syllables)
+
+    seconds = time.perf_counter() - start
+    latencies.sort()
+
+    return {
+        'sentences': len(latencies),
+        'syllables': syllable_count,
+        'seconds': seconds,
+        'sentences_per_second': len(latencies) / seconds if seconds else None,
+        'p50_latency_ms': percentile(latencies, 0.5) * 1000 if latencies else None,
+        'p99_latency_ms': percentile(latencies, 0.99) * 1000 if latencies else None
+    }
+
+def train(method, training_filenames, directory, options):
+    start = time.perf_counter()
+    model_filename = trainers[method](training_filenames, os.path.join(directory, f'{method}.model'), options)
+    training_seconds = time.perf_counter() - start
+    write_synthetic_corpus(training_filenames, options['synthetic'], os.path.join(directory, 'synthetic.txt'))
+
+    return {
+        'model_filename': model_filename,
+        'training_seconds': training_seconds,
+        'training_peak_rss_kb': peak_rss_kb()
+    }
+
+def serve(method, model_filename, test_filenames, directory, options):
+    result = {}
+    start = time.perf_counter()
+    model = segmentation.load(method, model_filename, options['dictionary'])
+    result['load_seconds'] = time.perf_counter() - start
+    result['corpus'] = measure(method, model, (syllables for syllables, actual_boundaries in read_corpus(test_filenames, cache=True)))
+    result['synthetic'] = measure(method, model, read_synthetic_corpus(os.path.join(directory, 'synthetic.txt')))
+    result['peak_rss_kb'] = peak_rss_kb()
+    return result
+
+# Here, we call a function in a new process and send back what it returns, or the exception it raises.
+# These are plain processes rather than a pool's, which are daemonic, so that training can start a pool of its own, like train_parallel.
+
+def call(connection, function, arguments):
+    try:
+        connection.send((function(*arguments), None))
+
+    except Exception as exception:
+        connection.send((None, exception))
+
+    connection.close()
+
+def in_process(function, *arguments):
+    context = multiprocessing.get_context('spawn')
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=call, args=(sender, function, arguments))
+    process.start()
+    sender.close()
+
+    try:
+        result, exception = receiver.recv()
+
+    except EOFError:
+        raise RuntimeError(f'{function.__name__} exited with code {process.exitcode}') from None
+
+    finally:
+        process.join()
+        receiver.close()
+
+    if exception is not None:
+        raise exception
+
+    return result
+
+def run(method, training_filenames, test_filenames, options):
+    result = {'method': method}
+
+    with tempfile.TemporaryDirectory() as directory:
+        training = in_process(train, method, training_filenames, directory, options)
+        result['training_seconds'] = training['training_seconds']
+        result['training_peak_rss_kb'] = training['training_peak_rss_kb']
+        result.update(in_process(serve, method, training['model_filename'], test_filenames, directory, options))
+
+    return result
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description='Benchmark the cost of the segmentation methods.')
+    parser.add_argument('--corpus', default='EVBCorpus_EVBNews_v2.0', help='the EVBCorpus directory (default: EVBCorpus_EVBNews_v2.0)')
+    parser.add_argument('--dictionary', default='Viet74K.txt', help='the dictionary for maximal matching and the hybrid methods (default: Viet74K.txt)')
+    parser.add_argument('--news', help='a file of raw sentences to train transitional frequencies on (default: the training files)')
+    parser.add_argument('--train', type=int, nargs=2, default=[1, 750], metavar=('FIRST', 'LAST'), help='the range of training files (default: 1 750)')
+    parser.add_argument('--test', type=int, nargs=2, default=[750, 800], metavar=('FIRST', 'LAST'), help='the range of test files (default: 750 800)')
+    parser.add_argument('--synthetic', type=int, default=100000, help='the number of synthetic sentences (default: 100000)')
+    parser.add_argument('--methods', nargs='+', choices=list(trainers), default=list(trainers), help='the methods to benchmark (default: all)')
+    parser.add_argument('--output', default='benchmark.json', help='the file to write the results to (default: benchmark.json)')
+    arguments = parser.parse_args(arguments)
+
+    training_filenames = [os.path.join(arguments.corpus, f'N{number:04d}.sgml') for number in range(*arguments.train)]
+    test_filenames = [os.path.join(arguments.corpus, f'N{number:04d}.sgml') for number in range(*arguments.test)]
+    options = {'dictionary': os.path.abspath(arguments.dictionary), 'news': arguments.news, 'synthetic': arguments.synthetic}
+    results = []
+
+    for method in arguments.methods:
+        print(f'Benchmarking {method}...')
+
+        result = run(method, training_filenames, test_filenames, options)
+        print(f'    {result["corpus"]["sentences_per_second"]:.0f} sentences/s, p99 {result["corpus"]["p99_latency_ms"]:.3f} ms, {result["peak_rss_kb"] / 1024:.1f} MB, {result["training_peak_rss_kb"] / 1024:.1f} MB training')
+        results.append(result)
+
+    with open(arguments.output, 'w') as file:
+        json.dump({'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'arguments': vars(arguments), 'results': results}, file, indent=4)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,39 @@
+import functools
+from chunking import segment_clauses, segment_text
+from normalization import normalize_cached
+
+# This memoizes a decoder, so that sentences that come up again, like boilerplate, headlines, and bylines, are only decoded once.
+# Segmentations are kept in a bounded LRU cache keyed by the tuple of normalized syllables, with the hits and misses counted.
+# The sentences are normalized through the LRU cache of normalization.normalize_cached too, so a repeated sentence is not normalized again.
+#
+# Optionally, sentences are split into clauses at punctuation, and each clause is decoded and cached by itself,
+# so that phrases that repeat inside otherwise different sentences are also only decoded once.
+# Punctuation always ends a word, so the clauses are joined with word boundaries between them.
+# The decoders see less context this way, so this can posit slightly different boundaries around the punctuation.
+
+class CachedDecoder:
+    def __init__(self, decode, maxsize=65536, clauses=False):
+        self.clauses = clauses
+        self.decode = functools.lru_cache(maxsize=maxsize)(lambda syllables: tuple(decode(list(syllables))))
+
+    def posit_boundaries(self, syllables):
+        return list(self.decode(tuple(syllables)))
+
+    # Here, we normalize and segment a raw sentence, returning its syllables and word boundaries.
+
+    def segment(self, sentence):
+        if self.clauses:
+            return segment_clauses(sentence, self.posit_boundaries, normalize_cached)
+
+        return segment_text(sentence, self.posit_boundaries, normalize_cached)
+
+    def stats(self):
+        hits, misses, maxsize, size = self.decode.cache_info()
+
+        return {
+            'hits': hits,
+            'misses': misses,
+            'size': size,
+            'maxsize': maxsize,
+            'hit_rate': hits / (hits + misses) if hits + misses else 0
+        }
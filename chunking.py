@@ -0,0 +1,118 @@
+import re
+from normalization import normalize
+
+# This splits long inputs, like a paragraph pasted as one line, into chunks that are decoded independently and stitched back together,
+# so that the time and memory for one input stay bounded however long it is.
+#
+# Raw text is first split into clauses at punctuation, which normalize() strips, and which always ends a word.
+# A run of syllables that is still longer than MAX_LENGTH is then split at the position within MAX_LENGTH syllables
+# that costs the least to break at, the latest one if there is a tie. With a lexicon, the cost is how many of its words cross the position,
+# looking MAX_WORD_LENGTH syllables ahead at most, so a break where no word crosses is taken if there is one, and forced otherwise.
+# Decoders without a lexicon, like the HMMs, give their own costs, such as whether a syllable rarely starts a word.
+# Sentences that are no longer than MAX_LENGTH syllables are decoded as they are, so the usual results do not change.
+
+MAX_LENGTH = 256
+MAX_WORD_LENGTH = 16
+
+clause_pattern = re.compile(r'[,;:.!?…()\[\]{}"“”‘’«»]+|\s[-–—]+\s')
+
+# Here, we find the chunks of a list of syllables, yielding (start, end) pairs in order.
+# costs(syllables, start, end) gives a list where costs[p - start] is the cost of breaking before syllables[p], for start < p <= end.
+# Without costs, the chunks are simply MAX_LENGTH syllables long.
+
+def split(syllables, costs=None, max_length=MAX_LENGTH):
+    start = 0
+
+    while len(syllables) - start > max_length:
+        end = start + max_length
+        best = end
+
+        if costs is not None:
+            window = costs(syllables, start, end)
+
+            for p in range(end - 1, start, -1):
+                if window[best - start] <= 0:
+                    break
+
+                if window[p - start] < window[best - start]:
+                    best = p
+
+        yield start, best
+        start = best
+
+    yield start, len(syllables)
+
+# Here, we get the costs for a lexicon in a trie: crossings[p - start] counts the words that start before syllables[p] and end after it,
+# which is worked out with a difference array from the words found by walking the trie from each syllable in the window.
+
+def crossings(trie, max_word_length=MAX_WORD_LENGTH):
+    def costs(syllables, start, end):
+        crossings = [0] * (end - start + 2)
+        ids = trie.encode(syllables[start:min(end + max_word_length, len(syllables))])
+
+        for i in range(start, end):
+            node = trie.roots[ids[i - start]]
+            j = i + 1
+
+            while node >= 0 and j - start < len(ids) and j - i < max_word_length:
+                node = trie.child(node, ids[j - start])
+                j += 1
+
+                if node >= 0 and trie.words[node] >= 0:
+                    crossings[i + 1 - start] += 1
+                    crossings[min(j, end + 1) - start] -= 1
+
+        for p in range(1, end - start + 1):
+            crossings[p] += crossings[p - 1]
+
+        return crossings
+
+    return costs
+
+# Here, we decode a long list of syllables chunk by chunk and stitch the results together.
+# For decoders that return word boundaries, the chunks are joined with a boundary between them,
+# and for decoders that return tags, such as BI-tags, the tags are simply concatenated, since every chunk starts a word.
+
+def decode_chunked(decode, syllables, costs=None, tags=False, max_length=MAX_LENGTH):
+    results = []
+
+    for start, end in split(syllables, costs, max_length):
+        if results and not tags:
+            results.append(1)
+
+        results.extend(decode(syllables[start:end]))
+
+    return results
+
+# Here, we normalize and segment a raw sentence, returning its syllables and word boundaries.
+# A sentence that is longer than MAX_LENGTH syllables is split into clauses at its punctuation first, and the decoders split clauses that are still long.
+# Both the cached and the uncached paths segment sentences with this, so that a cache never changes the output.
+# The normalizer can be swapped, such as for normalization.normalize_cached by the cache of segmentations.
+
+def segment_text(sentence, decode, normalize=normalize):
+    syllables = normalize(sentence).split()
+
+    if len(syllables) > MAX_LENGTH:
+        return segment_clauses(sentence, decode, normalize)
+
+    return syllables, decode(syllables)
+
+# Here, we normalize and segment a raw sentence clause by clause, returning its syllables and word boundaries.
+
+def segment_clauses(sentence, decode, normalize=normalize):
+    syllables = []
+    boundaries = []
+
+    for clause in clause_pattern.split(sentence):
+        clause_syllables = normalize(clause).split()
+
+        if not clause_syllables:
+            continue
+
+        if syllables:
+            boundaries.append(1)
+
+        syllables.extend(clause_syllables)
+        boundaries.extend(decode(clause_syllables))
+
+    return syllables, boundaries
@@ -0,0 +1,105 @@
+import os
+import pickle
+import re
+from instrumentation import timed
+from normalization import normalize
+
+# This reads the sentence pairs of the EVBCorpus SGML files.
+# Each sentence pair looks like this:
+#
+#     <spair id="1">
+#     <s id="en1">...</s>
+#     <s id="vn1">...</s>
+#     <a>1-1;2-2,3;...;</a>
+#     </spair>
+#
+# The annotation maps English words to the indices of Vietnamese syllables,
+# so two consecutive syllables aligned to the same English word belong to the same Vietnamese word.
+
+sentence_pattern = re.compile(r'<.*?>|</s>')
+annotation_pattern = re.compile(r'<.*?>|;</a>\n')
+
+# Here, we parse one file lazily, yielding the syllables and the actual word boundaries of each sentence.
+# actual_boundaries[i] is 1 if there is a word boundary between syllables[i] and syllables[i + 1].
+# Sentences with malformed annotations are skipped.
+
+@timed('parsing')
+def parse_sgml(filename):
+    with open(filename, 'r') as file:
+        for line in file:
+            if not line.startswith('<spair'):
+                continue
+
+            next(file)
+            syllables = normalize(sentence_pattern.sub('', next(file))).split()
+            actual_boundaries = [1] * (len(syllables) - 1)
+
+            try:
+                for annotation in annotation_pattern.sub('', next(file)).split(';'):
+                    syllable_indices = [int(_) - 1 for _ in annotation.split('-')[1].split(',')]
+
+                    for i, j in zip(syllable_indices[:-1], syllable_indices[1:]):
+                        if i + 1 == j:
+                            actual_boundaries[i] = 0
+
+            except IndexError:
+                continue
+
+            except ValueError:
+                continue
+
+            yield syllables, actual_boundaries
+
+# Here, we do the same, but optionally through a binary cache next to the SGML file.
+# The cache is a stream of pickled records, so it is read back lazily as well,
+# and it is only used if it is newer than the SGML file it was made from.
+
+def read_sgml(filename, cache=False):
+    cache_filename = f'{filename}.pickle'
+
+    if cache and os.path.exists(cache_filename) and os.path.getmtime(cache_filename) >= os.path.getmtime(filename):
+        with open(cache_filename, 'rb') as file:
+            while True:
+                try:
+                    yield pickle.load(file)
+
+                except EOFError:
+                    return
+
+    if not cache:
+        yield from parse_sgml(filename)
+        return
+
+    # The cache is written to a temporary file first, so that a partially read file never leaves a truncated cache behind.
+
+    temporary_filename = f'{cache_filename}.{os.getpid()}'
+
+    try:
+        with open(temporary_filename, 'wb') as file:
+            for record in parse_sgml(filename):
+                pickle.dump(record, file, pickle.HIGHEST_PROTOCOL)
+                yield record
+
+        os.replace(temporary_filename, cache_filename)
+
+    finally:
+        if os.path.exists(temporary_filename):
+            os.remove(temporary_filename)
+
+def read_corpus(filenames, cache=False):
+    for filename in filenames:
+        yield from read_sgml(filename, cache)
+
+# Here, we get the actual words from the syllables and the word boundaries.
+
+def join_words(syllables, boundaries):
+    words = []
+    start = 0
+
+    for i, boundary in enumerate(boundaries):
+        if boundary:
+            words.append(' '.join(syllables[start:i + 1]))
+            start = i + 1
+
+    words.append(' '.join(syllables[start:]))
+    return words
@@ -0,0 +1,217 @@
+import argparse
+import json
+import multiprocessing
+import os
+import statistics
+import time
+import graphs
+import hmm
+import hybrid
+import segmentation
+import transitional_frequencies
+import trigram_hmm
+from corpus import join_words, read_sgml
+from dataset import Dataset
+from evaluation import Evaluation
+from instrumentation import progress
+from normalization import normalize
+from trie import build_trie, read_words
+
+# This is k-fold cross-validation of the segmentation methods over the EVBCorpus files.
+# The files are dealt out to k folds in turn, and for each method and fold, a model is trained on the other folds and tested on that fold.
+# Every (method, fold) pair runs in its own worker process.
+# The corpus is parsed once, before the workers start, into a module-level list, and the workers are forked,
+# so they share the parsed sentences with the parent instead of each reading the files again.
+# The corpus can also be read from a dataset that dataset.py made from it, which holds every file as a document.
+# The dataset is then kept in a module-level variable, with its columns memory-mapped, and each document is only the range of its sentences,
+# so the workers read each sentence from the shared columns when they need it, instead of the whole corpus being copied into lists first.
+
+documents = []
+corpus_dataset = None
+
+# Models that do not depend on the fold, such as the dictionary, are made once, before the workers start, into a module-level dict as well,
+# so the workers inherit them instead of having them pickled into every job.
+
+models = {}
+
+def load_documents(filenames, dataset=None):
+    global corpus_dataset
+    corpus_dataset = dataset
+
+    if dataset is not None:
+        documents[:] = [(os.path.basename(filename), dataset.document(os.path.basename(filename))) for filename in filenames]
+
+    else:
+        documents[:] = [(os.path.basename(filename), list(read_sgml(filename, cache=True))) for filename in filenames]
+
+def folds(k):
+    return [list(range(i, len(documents), k)) for i in range(k)]
+
+def document_sentences(index):
+    if corpus_dataset is not None:
+        return map(corpus_dataset.sentence, documents[index][1])
+
+    return documents[index][1]
+
+def sentences(indices):
+    for index in indices:
+        yield from document_sentences(index)
+
+# Each method is cross-validated by giving it a trainer here, which trains a model on the sentences that a function yields and returns it.
+# Models that do not depend on the fold are taken from models.
+# Transitional frequencies are trained on the raw syllables of the sentences, unless a model trained on a news corpus is given,
+# and their threshold is tuned on the training sentences.
+
+def train_maximal_matching(training):
+    return models['maximal_matching']
+
+def train_hmm(training):
+    model = hmm.HMM()
+
+    for syllables, actual_boundaries in training():
+        model.train(syllables, actual_boundaries)
+
+    model.estimate()
+    return model
+
+def train_trigram_hmm(training):
+    model = trigram_hmm.TrigramHMM()
+
+    for syllables, actual_boundaries in training():
+        model.train(syllables, actual_boundaries)
+
+    model.estimate()
+    return model
+
+def train_graphs(training):
+    model = graphs.BigramModel()
+
+    for syllables, actual_boundaries in training():
+        model.train(join_words(syllables, actual_boundaries))
+
+    return model
+
+def train_transitional_frequencies(training):
+    model = models.get('transitional_frequencies')
+
+    if model is None:
+        model = transitional_frequencies.TransitionalModel()
+
+        for syllables, actual_boundaries in training():
+            model.train(syllables)
+
+    model.threshold = transitional_frequencies.tune(model, training(), transitional_frequencies.loners)
+    return model
+
+def train_hybrid_graphs(training):
+    return hybrid.HybridDecoder(train_graphs(training), models['dictionary'])
+
+def train_hybrid_hmm(training):
+    return hybrid.HybridDecoder(train_hmm(training), models['dictionary'])
+
+trainers = {
+    'maximal_matching': train_maximal_matching,
+    'hmm': train_hmm,
+    'trigram_hmm': train_trigram_hmm,
+    'graphs': train_graphs,
+    'transitional_frequencies': train_transitional_frequencies,
+    'hybrid_graphs': train_hybrid_graphs,
+    'hybrid_hmm': train_hybrid_hmm
+}
+
+def run_fold(method, fold, k):
+    test_indices = folds(k)[fold]
+    training_indices = sorted(set(range(len(documents))) - set(test_indices))
+    start = time.perf_counter()
+    model = trainers[method](lambda: sentences(training_indices))
+    training_seconds = time.perf_counter() - start
+    evaluation = Evaluation()
+
+    for index in test_indices:
+        for syllables, actual_boundaries in document_sentences(index):
+            evaluation.add(actual_boundaries, segmentation.posit_boundaries(method, model, syllables), documents[index][0], len(syllables))
+
+    return method, fold, training_seconds, evaluation
+
+def run_fold_job(job):
+    return run_fold(*job)
+
+# Here, we cross-validate some methods, returning a merged evaluation and the F1 of each fold for every method.
+
+def cross_validate(filenames, methods, k=5, processes=None, options=None):
+    options = dict(options or {})
+    load_documents(filenames, options.pop('dataset', None))
+
+    if len(documents) < k:
+        raise ValueError(f'Cannot make {k} folds out of {len(documents)} files')
+
+    # Models that do not depend on the fold are made once here, before the pool forks the workers.
+
+    models.clear()
+
+    if any(method == 'maximal_matching' or method.startswith('hybrid_') for method in methods):
+        models['dictionary'] = read_words(options['dictionary'], normalize)
+        models['maximal_matching'] = build_trie(models['dictionary'])
+
+    if 'transitional_frequencies' in methods and options.get('news'):
+        if options['news'].endswith('.dataset'):
+            models['transitional_frequencies'] = transitional_frequencies.TransitionalModel()
+            models['transitional_frequencies'].train_dataset(Dataset.load(options['news']))
+
+        else:
+            models['transitional_frequencies'] = transitional_frequencies.train_parallel(options['news'], processes)
+
+    results = {method: {'evaluation': Evaluation(), 'fold_f1': [None] * k, 'fold_word_f1': [None] * k, 'training_seconds': [None] * k} for method in methods}
+    jobs = [(method, fold, k) for method in methods for fold in range(k)]
+
+    with multiprocessing.get_context('fork').Pool(processes) as pool:
+        for i, (method, fold, training_seconds, evaluation) in enumerate(pool.imap_unordered(run_fold_job, jobs)):
+            progress(f'Cross-validating... {(i + 1) / len(jobs) : 5.2%}', final=i + 1 == len(jobs))
+            result = results[method]
+            result['evaluation'].merge(evaluation)
+            result['fold_f1'][fold] = evaluation.metrics()[3]
+            result['fold_word_f1'][fold] = evaluation.word_metrics()[2]
+            result['training_seconds'][fold] = training_seconds
+
+    return results
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description='Cross-validate the segmentation methods over the EVBCorpus files.')
+    parser.add_argument('--corpus', default='EVBCorpus_EVBNews_v2.0', help='the EVBCorpus directory (default: EVBCorpus_EVBNews_v2.0)')
+    parser.add_argument('--dictionary', default='Viet74K.txt', help='the dictionary for maximal matching and the hybrid methods (default: Viet74K.txt)')
+    parser.add_argument('--dataset', help='a dataset made from the EVBCorpus directory by dataset.py, to read instead of the SGML files')
+    parser.add_argument('--news', help='a file of raw sentences, or a dataset made from one, to train transitional frequencies on (default: the training folds)')
+    parser.add_argument('-k', '--folds', type=int, default=5, help='the number of folds (default: 5)')
+    parser.add_argument('-p', '--processes', type=int, help='the number of worker processes (default: the number of CPUs)')
+    parser.add_argument('--methods', nargs='+', choices=list(trainers), default=list(trainers), help='the methods to cross-validate (default: all)')
+    parser.add_argument('--output', help='a file to write the results to as JSON, with a breakdown per file')
+    arguments = parser.parse_args(arguments)
+
+    options = {'dictionary': os.path.abspath(arguments.dictionary), 'news': arguments.news}
+
+    if arguments.dataset:
+        options['dataset'] = Dataset.load(arguments.dataset)
+        filenames = options['dataset'].names.tokens[1:]
+
+    else:
+        filenames = sorted(os.path.join(arguments.corpus, filename) for filename in os.listdir(arguments.corpus) if filename.endswith('.sgml'))
+
+    results = cross_validate(filenames, arguments.methods, arguments.folds, arguments.processes, options)
+
+    for method, result in results.items():
+        accuracy, precision, recall, f1 = result['evaluation'].metrics()
+        print(f'{method}:')
+        print(f'    F1: {statistics.mean(result["fold_f1"]):.4f} ± {statistics.stdev(result["fold_f1"]) if len(result["fold_f1"]) > 1 else 0:.4f}')
+        print(f'    Word F1: {statistics.mean(result["fold_word_f1"]):.4f} ± {statistics.stdev(result["fold_word_f1"]) if len(result["fold_word_f1"]) > 1 else 0:.4f}')
+        print(f'    Pooled accuracy, precision, recall, F1: {accuracy:.4f}, {precision:.4f}, {recall:.4f}, {f1:.4f}')
+
+    if arguments.output:
+        with open(arguments.output, 'w') as file:
+            json.dump({
+                'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'arguments': vars(arguments),
+                'results': {method: {'fold_f1': result['fold_f1'], 'fold_word_f1': result['fold_word_f1'], 'training_seconds': result['training_seconds'], **result['evaluation'].report()} for method, result in results.items()}
+            }, file, indent=4)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+import argparse
+import os
+from array import array
+import storage
+from corpus import read_sgml
+from instrumentation import progress
+from normalization import normalize
+from vocabulary import Vocabulary
+
+# This is a corpus that was parsed and normalized once, stored in columns, so that training and testing never handle text again:
+#
+#     ids         the syllable IDs of all the sentences, one after another, as a flat array of int32
+#     offsets     offsets[i] to offsets[i + 1] is the range of ids of sentence i
+#     boundaries  a bitmap of the actual word boundaries, where bit p is 1 if there is a boundary between syllables p and p + 1,
+#                 which only annotated corpora have
+#     documents   documents[d - 1] to documents[d] is the range of sentences of the document with ID d in names,
+#                 such as an EVBCorpus file
+#
+# A dataset is saved in the model file format, so loading it memory-maps the columns, and the IDs of a sentence are a slice of the mapping.
+# It can be made from EVBCorpus SGML files or from a file of raw sentences, one per line, like the news corpus:
+#
+#     python dataset.py EVBCorpus_EVBNews_v2.0 evbcorpus.dataset
+#     python dataset.py vie_news_2022_1M/vie_news_2022_1M-sentences.txt news.dataset
+
+class Dataset:
+    def __init__(self, annotated=True):
+        self.vocabulary = Vocabulary()
+        self.names = Vocabulary()
+        self.ids = array('i')
+        self.offsets = array('Q', [0])
+        self.boundaries = array('B') if annotated else None
+        self.documents = array('Q', [0])
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def add(self, syllables, actual_boundaries=None):
+        start = len(self.ids)
+        self.ids.extend(self.vocabulary.add(syllable) for syllable in syllables)
+        self.offsets.append(len(self.ids))
+
+        if self.boundaries is not None:
+            self.boundaries.extend(bytes((len(self.ids) + 7) // 8 - len(self.boundaries)))
+
+            for i, boundary in enumerate(actual_boundaries):
+                if boundary:
+                    self.boundaries[(start + i) >> 3] |= 1 << ((start + i) & 7)
+
+    # Here, we end a document, made of the sentences that were added since the last one ended.
+
+    def add_document(self, name):
+        self.names.add(name)
+        self.documents.append(len(self))
+
+    def sentence_ids(self, i):
+        return self.ids[self.offsets[i]:self.offsets[i + 1]]
+
+    def sentence_boundaries(self, i):
+        boundaries = self.boundaries
+        return [boundaries[p >> 3] >> (p & 7) & 1 for p in range(self.offsets[i], self.offsets[i + 1] - 1)]
+
+    def sentence(self, i):
+        tokens = self.vocabulary.tokens
+        syllables = [tokens[id] for id in self.sentence_ids(i)]
+        return syllables, self.sentence_boundaries(i) if self.boundaries is not None else None
+
+    # Here, we get the range of the sentences of a document.
+
+    def document(self, name):
+        d = self.names.get(name)
+
+        if not d:
+            raise KeyError(f'{name} is not in the dataset')
+
+        return range(self.documents[d - 1], self.documents[d])
+
+    # Here, we yield the syllables and the actual word boundaries of the sentences of some documents, like corpus.read_corpus.
+
+    def read(self, names):
+        for name in names:
+            for i in self.document(name):
+                yield self.sentence(i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.sentence(i)
+
+    def save(self, filename):
+        sections = {
+            'vocabulary': self.vocabulary,
+            'names': self.names,
+            'ids': self.ids,
+            'offsets': self.offsets,
+            'documents': self.documents
+        }
+
+        if self.boundaries is not None:
+            sections['boundaries'] = self.boundaries
+
+        storage.save(filename, 'dataset', sections)
+
+    @classmethod
+    def load(cls, filename):
+        sections = storage.load(filename, 'dataset')
+        dataset = cls()
+
+        for name, section in sections.items():
+            setattr(dataset, name, section)
+
+        if 'boundaries' not in sections:
+            dataset.boundaries = None
+
+        return dataset
+
+# Here, we make a dataset from EVBCorpus SGML files, with one document for each file.
+
+def from_sgml(filenames):
+    dataset = Dataset()
+
+    for i, filename in enumerate(filenames):
+        progress(f'Reading... {i / len(filenames) : 5.2%}')
+
+        for syllables, actual_boundaries in read_sgml(filename, cache=True):
+            dataset.add(syllables, actual_boundaries)
+
+        dataset.add_document(os.path.basename(filename))
+
+    return dataset
+
+# Here, we make a dataset from a file of raw sentences, one per line, as a single document without word boundaries.
+
+def from_text(filename):
+    dataset = Dataset(annotated=False)
+
+    with open(filename, 'r') as file:
+        for line in file:
+            syllables = normalize(line).split()
+
+            if syllables:
+                dataset.add(syllables)
+
+    dataset.add_document(os.path.basename(filename))
+    return dataset
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Preprocess a corpus into a columnar dataset.')
+    parser.add_argument('corpus', help='a directory of EVBCorpus SGML files, or a file of raw sentences, one per line')
+    parser.add_argument('output', help='the file to save the dataset to')
+    arguments = parser.parse_args()
+
+    if os.path.isdir(arguments.corpus):
+        dataset = from_sgml(sorted(os.path.join(arguments.corpus, filename) for filename in os.listdir(arguments.corpus) if filename.endswith('.sgml')))
+
+    else:
+        dataset = from_text(arguments.corpus)
+
+    dataset.save(arguments.output)
+    print(f'{len(dataset)} sentences, {len(dataset.ids)} syllables, {len(dataset.vocabulary) - 1} distinct syllables')
@@ -0,0 +1,122 @@
+import operator
+from instrumentation import timed
+
+# This is the evaluation shared by all of the segmenters.
+# Word boundaries are compared position by position, where boundaries[i] is 1 if there is a word boundary between syllables i and i + 1,
+# and words are compared as spans of syllables, so a posited word only counts as correct if both of its ends and everything in between are right.
+# Counts from several evaluations, such as the shards of a parallel run, can be merged, and counts are also kept per file.
+# A sentence with one syllable has no boundaries, like a sentence with no syllables at all, such as one that was only digits or punctuation,
+# so add takes the number of syllables as well, and sentences with none are skipped instead of counting as one correct word.
+
+class Evaluation:
+    def __init__(self):
+        self.true_positives = 0
+        self.false_positives = 0
+        self.true_negatives = 0
+        self.false_negatives = 0
+        self.actual_words = 0
+        self.posited_words = 0
+        self.correct_words = 0
+        self.files = {}
+
+    @timed('evaluation')
+    def add(self, actual_boundaries, posited_boundaries, filename=None, length=None):
+        if length == 0:
+            return
+
+        # The confusion counts come from a few passes over the whole sentence instead of a branch per boundary.
+
+        true_positives = sum(map(operator.and_, actual_boundaries, posited_boundaries))
+        actual_positives = sum(actual_boundaries)
+        posited_positives = sum(posited_boundaries)
+        false_positives = posited_positives - true_positives
+        false_negatives = actual_positives - true_positives
+        true_negatives = len(actual_boundaries) - true_positives - false_positives - false_negatives
+        actual_words = spans(actual_boundaries)
+        posited_words = spans(posited_boundaries)
+        counts = (true_positives, false_positives, true_negatives, false_negatives, len(actual_words), len(posited_words), len(actual_words & posited_words))
+        self.add_counts(counts)
+
+        if filename is not None:
+            self.files.setdefault(filename, Evaluation()).add_counts(counts)
+
+    def add_counts(self, counts):
+        self.true_positives += counts[0]
+        self.false_positives += counts[1]
+        self.true_negatives += counts[2]
+        self.false_negatives += counts[3]
+        self.actual_words += counts[4]
+        self.posited_words += counts[5]
+        self.correct_words += counts[6]
+
+    def counts(self):
+        return (self.true_positives, self.false_positives, self.true_negatives, self.false_negatives, self.actual_words, self.posited_words, self.correct_words)
+
+    def merge(self, other):
+        self.add_counts(other.counts())
+
+        for filename, evaluation in other.files.items():
+            self.files.setdefault(filename, Evaluation()).add_counts(evaluation.counts())
+
+        return self
+
+    def metrics(self):
+        return metrics(self.true_positives, self.false_positives, self.true_negatives, self.false_negatives)
+
+    def word_metrics(self):
+        precision = divide(self.correct_words, self.posited_words)
+        recall = divide(self.correct_words, self.actual_words)
+        return precision, recall, divide(2 * precision * recall, precision + recall)
+
+    def report(self):
+        accuracy, precision, recall, f1 = self.metrics()
+        word_precision, word_recall, word_f1 = self.word_metrics()
+
+        report = {
+            'accuracy': accuracy,
+            'precision': precision,
+            'recall': recall,
+            'f1': f1,
+            'word_precision': word_precision,
+            'word_recall': word_recall,
+            'word_f1': word_f1
+        }
+
+        if self.files:
+            report['files'] = {filename: evaluation.report() for filename, evaluation in sorted(self.files.items())}
+
+        return report
+
+    def print(self):
+        accuracy, precision, recall, f1 = self.metrics()
+        print('Accuracy:', accuracy)
+        print('Precision:', precision)
+        print('Recall:', recall)
+        print('F1:', f1)
+        print('Word F1:', self.word_metrics()[2])
+
+# Here, we get the words of a sentence as (start, end) spans of syllable indices.
+
+def spans(boundaries):
+    spans = set()
+    start = 0
+
+    for i, boundary in enumerate(boundaries):
+        if boundary:
+            spans.add((start, i + 1))
+            start = i + 1
+
+    spans.add((start, len(boundaries) + 1))
+    return spans
+
+def divide(numerator, denominator):
+    return numerator / denominator if denominator else 0
+
+# Here, we will calculate the accuracy, precision, recall, and F1, which are 0 where they are undefined.
+
+def metrics(true_positives, false_positives, true_negatives, false_negatives):
+    accuracy = divide(true_positives + true_negatives, true_positives + true_negatives + false_positives + false_negatives)
+    precision = divide(true_positives, true_positives + false_positives)
+    recall = divide(true_positives, true_positives + false_negatives)
+    f1 = divide(2 * precision * recall, precision + recall)
+    return accuracy, precision, recall, f1
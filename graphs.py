@@ -1,223 +1,321 @@
 import collections
+import heapq
 import math
-import pickle
 import os
-import re
-import unicodedata
+from array import array
+import storage
+from corpus import join_words, read_corpus, read_sgml
+from evaluation import Evaluation
+from instrumentation import progress, timed
+from chunking import MAX_LENGTH, crossings, decode_chunked
+from trie import build_lattice, build_trie
+from vocabulary import UNKNOWN, Vocabulary, pair
+
+# Words are given IDs by the vocabulary, so unigram frequencies are a flat array indexed by word ID,
+# and bigram frequencies are keyed by the packed pair of word IDs instead of a tuple of strings.
+# Only the raw counts and their totals are kept, and probabilities are worked out from them when they are needed,
+# so that more data can be added to a trained model at any time.
+# For smoothing, we also keep how often each word is followed by another word and by how many different words.
+
+class BigramModel:
+    def __init__(self):
+        self.vocabulary = Vocabulary(['<bos>', '<eos>'])
+        self.bos = self.vocabulary.get('<bos>')
+        self.eos = self.vocabulary.get('<eos>')
+        self.unigram_counts = array('d', [0] * len(self.vocabulary))
+        self.history_counts = array('d', [0] * len(self.vocabulary))
+        self.follower_counts = array('d', [0] * len(self.vocabulary))
+        self.bigram_counts = {}
+        self.totals = array('d', [0, 0])
+        self.frozen = None
+
+    # Here, we count unigram and bigram frequencies.
+
+    def train(self, words):
+        ids = [self.bos]
+
+        for word in words:
+            id = self.vocabulary.add(word)
+
+            if id == len(self.unigram_counts):
+                self.unigram_counts.append(0)
+                self.history_counts.append(0)
+                self.follower_counts.append(0)
+
+            self.unigram_counts[id] += 1
+            ids.append(id)
+
+        ids.append(self.eos)
+
+        for i in range(len(ids) - 1):
+            key = pair(ids[i], ids[i + 1])
+            count = self.bigram_counts.get(key, 0)
+            self.bigram_counts[key] = count + 1
+            self.history_counts[ids[i]] += 1
+
+            if count == 0:
+                self.follower_counts[ids[i]] += 1
+
+        self.totals[0] += len(words)
+        self.totals[1] += len(ids) - 1
+        self.frozen = None
+
+    # Here, we add more annotated SGML files to a trained model.
+
+    def update(self, filenames):
+        for name in ('unigram_counts', 'history_counts', 'follower_counts', 'totals'):
+            setattr(self, name, storage.thaw(getattr(self, name)))
+
+        if isinstance(self.bigram_counts, storage.FrozenTable):
+            self.bigram_counts = dict(self.bigram_counts.items())
+
+        for syllables, actual_boundaries in read_corpus(filenames):
+            self.train(join_words(syllables, actual_boundaries))
+
+    # Here, we get a scorer for the model as it is now, which is kept until the model is trained further.
+
+    def scorer(self):
+        if self.frozen is None:
+            self.frozen = BigramScorer(self)
+
+        return self.frozen
+
+    def decode(self, syllables):
+        return self.scorer().decode(syllables)
+
+    def decode_nbest(self, syllables, k):
+        return self.scorer().decode_nbest(syllables, k)
+
+    def lattice(self, syllables):
+        return self.scorer().lattice(syllables)
+
+    # Here, we save the trained model, or load it with the arrays memory-mapped from the file.
+    # The bigram counts are saved as a sorted array of keys and a parallel array of values, which a loaded model looks up by binary search.
+    # A loaded model is read-only until it is updated, which copies the arrays into memory.
+
+    def save(self, filename):
+        bigram_counts = storage.FrozenTable.from_dict(self.bigram_counts)
+
+        storage.save(filename, 'bigram', {
+            'vocabulary': self.vocabulary,
+            'unigram_counts': self.unigram_counts,
+            'history_counts': self.history_counts,
+            'follower_counts': self.follower_counts,
+            'bigram_keys': bigram_counts.sorted_keys,
+            'bigram_values': bigram_counts.sorted_values,
+            'totals': self.totals
+        })
+
+    @classmethod
+    def load(cls, filename):
+        sections = storage.load(filename, 'bigram')
+        model = cls()
+        model.vocabulary = sections['vocabulary']
+        model.unigram_counts = sections['unigram_counts']
+        model.history_counts = sections['history_counts']
+        model.follower_counts = sections['follower_counts']
+        model.bigram_counts = storage.FrozenTable(sections['bigram_keys'], sections['bigram_values'])
+        model.totals = sections['totals']
+        return model
+
+# This scores bigrams with interpolated absolute discounting, in log space:
+#
+#     P(w | v) = max(c(v, w) - D, 0) / c(v) + D * N(v) / c(v) * P(w)
+#
+# where c(v) is how often v is followed by any word, N(v) is how many different words follow v,
+# and P(w) is the add-one smoothed unigram probability, so unseen bigrams and unknown words still get a small probability.
+# The counts are copied when the scorer is made, with the bigram counts frozen into a storage.FrozenTable like a loaded model's,
+# so a scorer can be shared by several threads, and it keeps scoring with the counts it was made from while the model is trained further.
+# Vocabulary IDs are never reassigned, so the scorer only needs the words that were known when it was made, which are in its trie.
+
+class BigramScorer:
+    def __init__(self, model, discount=0.75):
+        self.vocabulary = model.vocabulary
+        self.bos = model.bos
+        self.unigram_counts = storage.snapshot(model.unigram_counts)
+        self.history_counts = storage.snapshot(model.history_counts)
+        self.follower_counts = storage.snapshot(model.follower_counts)
+        self.bigram_counts = storage.FrozenTable.from_dict(model.bigram_counts)
+        self.discount = discount
+        self.unigram_total = model.totals[0] + len(model.vocabulary)
+        self.trie = build_trie(model.vocabulary.tokens)
+
+    def log_probability(self, previous, word):
+        unigram_probability = (self.unigram_counts[word] + 1) / self.unigram_total
+        history_count = self.history_counts[previous]
+
+        if history_count == 0:
+            return math.log(unigram_probability)
+
+        count = self.bigram_counts.get(pair(previous, word), 0)
+        probability = max(count - self.discount, 0) / history_count
+        probability += self.discount * self.follower_counts[previous] / history_count * unigram_probability
+        return math.log(probability)
+
+    # Here, we posit words based on maximizing the product of bigram probabilities, which is the sum of their logarithms.
+    # This is done by setting up a graph where
+    # the vertices correspond to syllables
+    # and the edges correspond to choices of word segmentation.
+    # An edge occurs between two vertices if the syllables including and between the vertices forms a known word,
+    # which we find by walking a trie of the known words from each vertex.
+    # This graph is a dag, so we can use dynamic programming to score paths.
+    # The probability of a word depends on the word before it, so the states of the DP are the edges rather than the vertices:
+    # scores[e] is the best score of the paths that end with edge e, which extends the best of the edges that end where e starts.
+    # Keeping only the best path into each vertex would lose paths whose last word makes the next word more likely.
+    # The lattice can also come from elsewhere, such as the hybrid decoder, with a log bonus for each edge.
+    # Long inputs are decoded in chunks split where no known word crosses.
+
+    @timed('decoding')
+    def decode(self, syllables):
+        if len(syllables) > MAX_LENGTH:
+            return decode_chunked(self.decode, syllables, crossings(self.trie))
+
+        return self.decode_lattice(syllables, *build_lattice(self.trie, syllables, UNKNOWN))
+
+    def decode_lattice(self, syllables, offsets, ends, words, bonuses=None):
+        if not syllables:
+            return []
+
+        scores = array('d', [-math.inf] * len(ends))
+        previous_edge = array('i', [-1] * len(ends))
+        ending = [[] for _ in range(len(syllables) + 1)]
+
+        for i in range(len(syllables)):
+            for e in range(offsets[i], offsets[i + 1]):
+                if i == 0:
+                    scores[e] = self.log_probability(self.bos, words[e])
 
-# First, we will train.
-
-os.chdir('EVBCorpus_EVBNews_v2.0')
-
-def normalize(string):
-    alphabet = 'aàảãáạăằẳẵắặâầẩẫấậbcdđeèẻẽéẹêềểễếệfghiìỉĩíịjklmnoòỏõóọôồổỗốộơờởỡớợpqrstuùủũúụưừửữứựvwxyỳỷỹýỵz'
-    return re.sub(f'[^{alphabet} ]', '', unicodedata.normalize('NFC', string).lower())
-
-unigram_frequencies = collections.defaultdict(int)
-bigram_frequencies = collections.defaultdict(int)
-
-for training_number in range(1, 750):
-    print(f'Training... {training_number / 750:5.2%}')
-
-    with open(f'N{training_number:04d}.sgml', 'r') as file:
-        for line in file:
-            if not line.startswith("<spair"):
-                continue
-
-            next(file)
-            syllables = normalize(re.sub(r'<.*?>|</s>', '', next(file))).split()
-
-            # Here, we will get the actual word boundaries from the training data.
-
-            try:
-                actual_boundaries = [1 for _ in range(len(syllables) - 1)]
-                annotations = re.sub(r'<.*?>|;</a>\n', '', next(file)).split(';')
-
-                for annotation in annotations:
-                    syllable_indices = [int(_) - 1 for _ in annotation.split('-')[1].split(',')]
-
-                    for i, j in zip(syllable_indices[:-1], syllable_indices[1:]):
-                        if i + 1 == j:
-                            actual_boundaries[i] = 0
-
-            except IndexError:
-                continue
-
-            except ValueError:
-                continue
-
-            # Here, we get the actual words.
-
-            words = ['']
-
-            for i in range(len(syllables) - 1):
-                words[-1] += syllables[i] + ' '
-
-                if actual_boundaries[i]:
-                    words[-1] = words[-1].strip()
-                    words.append('')
-
-            words[-1] += syllables[-1]
-
-            # Here, we count unigram and bigram frequencies.
-
-            bigram_frequencies[('<bos>', words[0])] += 1
-            bigram_frequencies[(words[-1], '<eos>')] += 1
-
-            for i in range(len(words)):
-                unigram_frequencies[words[i]] += 1
-
-                if i < len(words) - 1:
-                    bigram_frequencies[(words[i], words[i + 1])] += 1
+                else:
+                    for f in ending[i]:
+                        score = scores[f] + self.log_probability(words[f], words[e])
 
-# Here, we will conver the unigram and bigram frequencies to probabilities.
+                        if scores[e] < score or previous_edge[e] < 0:
+                            scores[e] = score
+                            previous_edge[e] = f
 
-s = sum(unigram_frequencies.values())
+                if bonuses is not None:
+                    scores[e] += bonuses[e]
 
-for unigram in unigram_frequencies:
-    unigram_frequencies[unigram] /= s
+                ending[ends[e]].append(e)
 
-s = sum(bigram_frequencies.values())
+        # Here, we will do a backward pass to extract the whole segmentation calculated by DP.
 
-for bigram in bigram_frequencies:
-    bigram_frequencies[bigram] /= s
+        e = -1
 
+        for f in ending[len(syllables)]:
+            if e < 0 or scores[e] < scores[f]:
+                e = f
 
-# Now, we will test.
+        posited_boundaries = [0 for _ in range(len(syllables) - 1)]
 
-true_positives = 0
-false_positives = 0
-true_negatives = 0
-false_negatives = 0
+        while e >= 0:
+            if ends[e] != len(syllables):
+                posited_boundaries[ends[e] - 1] = 1
 
-for test_number in range(750, 751):
-    print(f'Testing... {(test_number - 750) / (1001 - 750):5.2%}')
+            e = previous_edge[e]
 
-    with open(f'N{test_number:04d}.sgml', 'r') as file:
-        for line in file:
-            if not line.startswith("<spair"):
-                continue
+        return posited_boundaries
 
-            next(file)
-            syllables = normalize(re.sub(r'<.*?>|</s>', '', next(file))).split()
+    # Here, we find the k best segmentations, with their log probabilities, best first.
+    # Instead of one best path, each edge keeps the k best paths that end with it as (log probability, previous edge, rank of the path there).
+    # Every path is a different segmentation, since no two edges cover the same syllables.
 
-            # Here, we will get the actual word boundaries from the training data.
+    def decode_nbest(self, syllables, k):
+        if not syllables:
+            return [(0.0, [])]
 
-            try:
-                actual_boundaries = [1 for _ in range(len(syllables) - 1)]
-                annotations = re.sub(r'<.*?>|;</a>\n', '', next(file)).split(';')
+        offsets, ends, words = build_lattice(self.trie, syllables, UNKNOWN)
+        paths = [None] * len(ends)
+        ending = [[] for _ in range(len(syllables) + 1)]
 
-                for annotation in annotations:
-                    syllable_indices = [int(_) - 1 for _ in annotation.split('-')[1].split(',')]
+        for i in range(len(syllables)):
+            for e in range(offsets[i], offsets[i + 1]):
+                if i == 0:
+                    paths[e] = [(self.log_probability(self.bos, words[e]), -1, 0)]
 
-                    for i, j in zip(syllable_indices[:-1], syllable_indices[1:]):
-                        if i + 1 == j:
-                            actual_boundaries[i] = 0
+                else:
+                    candidates = [(score + self.log_probability(words[f], words[e]), f, r) for f in ending[i] for r, (score, _, _) in enumerate(paths[f])]
+                    paths[e] = heapq.nlargest(k, candidates, key=lambda candidate: candidate[0])
 
-            except IndexError:
-                continue
+                ending[ends[e]].append(e)
 
-            except ValueError:
-                continue
+        results = []
 
-            # Here, we get the actual words.
+        for score, e, r in heapq.nlargest(k, [(paths[e][r][0], e, r) for e in ending[len(syllables)] for r in range(len(paths[e]))], key=lambda candidate: candidate[0]):
+            posited_boundaries = [0 for _ in range(len(syllables) - 1)]
 
-            words = ['']
+            while e >= 0:
+                if ends[e] != len(syllables):
+                    posited_boundaries[ends[e] - 1] = 1
 
-            for i in range(len(syllables) - 1):
-                words[-1] += syllables[i] + ' '
+                _, e, r = paths[e][r]
 
-                if actual_boundaries[i]:
-                    words[-1] = words[-1].strip()
-                    words.append('')
+            results.append((score, posited_boundaries))
 
-            words[-1] += syllables[-1]
+        return results
 
-            # Here, we posit words based on maximizing the product of bigram frequencies.
-            # This is done by setting up a graph where
-            # the vertices correspond to syllables
-            # and the edges correspond to choices of word segmentation.
-            # An edge occurs between two vertices if the syllables including and between the vertices forms a valid word.
-            # This graph is a dag, so we can use dynamic programming to score paths.
+    # Here, we export the whole scored lattice of a sentence, so that it can be decoded or reranked elsewhere.
+    # Edges are [start, end, word], and transitions are [previous edge, edge, log probability],
+    # where the previous edge is -1 for the start of the sentence.
 
-            graph = collections.defaultdict(set)
+    def lattice(self, syllables):
+        offsets, ends, words = build_lattice(self.trie, syllables, UNKNOWN)
+        edges = []
+        transitions = []
+        ending = collections.defaultdict(list)
 
-            for i in range(len(syllables)):
-                for j in range(i, len(syllables)):
-                    next_word = ' '.join(syllables[i:j + 1])
+        for i in range(len(syllables)):
+            for e in range(offsets[i], offsets[i + 1]):
+                edges.append([i, ends[e], ' '.join(syllables[i:ends[e]])])
 
-                    if j + 1 - i > 1 and next_word not in unigram_frequencies:
-                        break
+                for f in (ending[i] if i > 0 else [-1]):
+                    transitions.append([f, e, self.log_probability(words[f] if f >= 0 else self.bos, words[e])])
 
-                    graph[i].add((i + (j + 1 - i), next_word))
+                ending[ends[e]].append(e)
 
-            previous_index = {}
-            previous_word = {}
-            scores = {}
-            previous_word[0] = '<bos>'
-            scores[0] = 1
-            s = sum(bigram_frequencies.values())
+        return {'syllables': syllables, 'edges': edges, 'transitions': transitions}
 
-            for i in range(len(syllables)):
-                for j, word in graph[i]:
-                    score = scores[i] * bigram_frequencies[(previous_word[i], word)]
+if __name__ == '__main__':
+    # First, we will train, unless there is already a trained model.
 
-                    if score == 0:
-                        score = scores[i] * (1 / s)
+    model_filename = os.path.abspath('graphs.model')
+    os.chdir('EVBCorpus_EVBNews_v2.0')
 
-                    if j not in scores or scores[j] < score:
-                        previous_index[j] = i
-                        previous_word[j] = word
-                        scores[j] = score
+    if not os.path.exists(model_filename):
+        model = BigramModel()
 
-            # Here, we will do a backward pass to extract the whole segmentation calculated by DP.
+        for training_number in range(1, 750):
+            progress(f'Training... {training_number / 750:5.2%}')
 
-            posited_boundaries = [0 for _ in range(len(syllables) - 1)]
-            posited_words = []
-            i = len(syllables)
+            for syllables, actual_boundaries in read_sgml(f'N{training_number:04d}.sgml', cache=True):
+                model.train(join_words(syllables, actual_boundaries))
 
-            while i != 0:
-                if i != len(syllables):
-                    posited_boundaries[i - 1] = 1
+        model.save(model_filename)
 
-                posited_words.append(previous_word[i])
-                i = previous_index[i]
+    model = BigramModel.load(model_filename)
 
-            posited_words.reverse()
+    # Now, we will test.
 
-            # Here, we will count true/false positives/negatives.
+    evaluation = Evaluation()
 
-            for i in range(len(syllables) - 1):
-                if actual_boundaries[i] == posited_boundaries[i]:
-                    if posited_boundaries[i] == 1:
-                        true_positives += 1
+    for test_number in range(750, 751):
+        progress(f'Testing... {(test_number - 750) / (1001 - 750):5.2%}')
 
-                    else:
-                        true_negatives += 1
+        filename = f'N{test_number:04d}.sgml'
 
-                else:
-                    if posited_boundaries[i] == 1:
-                        false_positives += 1
+        for syllables, actual_boundaries in read_sgml(filename, cache=True):
+            posited_boundaries = model.decode(syllables)
 
-                    else:
-                        false_negatives += 1
+            evaluation.add(actual_boundaries, posited_boundaries, filename, len(syllables))
 
             # print(syllables)
-            # print(words)
-            # print(posited_words)
+            # print(join_words(syllables, actual_boundaries))
+            # print(join_words(syllables, posited_boundaries))
             # print(actual_boundaries)
             # print(posited_boundaries)
             #
             # print()
 
-# Here, we will calculate the accuracy, precision, recall, and F1.
-
-accuracy = (true_positives + true_negatives) / (true_positives + true_negatives + false_positives + false_negatives)
-precision = true_positives / (true_positives + false_positives)
-recall = true_positives / (true_positives + false_negatives)
-f1 = (2 * precision * recall) / (precision + recall)
-print('Accuracy:', accuracy)
-print('Precision:', precision)
-print('Recall:', recall)
-print('F1:', f1)
+    # Here, we will calculate the accuracy, precision, recall, and F1.
 
+    evaluation.print()
@@ -1,183 +1,381 @@
-import collections
+import heapq
 import math
-import pickle
 import os
-import re
-import unicodedata
+from array import array
+import storage
+from chunking import MAX_LENGTH, decode_chunked
+from corpus import read_corpus, read_sgml
+from evaluation import Evaluation
+from instrumentation import progress, timed
+from vocabulary import Vocabulary
+
+# The notation in this file follows Jurafsky and Martin 2023.
 
-# First, we will train. The notation in this file follows Jurafsky and Martin 2023.
+# The states are numbered so that A, B, and π can be flat arrays.
+# A[2 * s_0 + s] is the probability of going from state s_0 to state s,
+# and B[2 * o + s] is the probability of state s given the syllable whose ID in the vocabulary is o.
+# Syllables that were never seen in training have ID 0, which has no counts, so their probabilities are 0 like before.
+# The raw counts are kept in A_counts and B_counts, so that more data can be added to a trained model later.
+
+Q = ['B', 'I']
 
-def normalize(string):
-    alphabet = 'aàảãáạăằẳẵắặâầẩẫấậbcdđeèẻẽéẹêềểễếệfghiìỉĩíịjklmnoòỏõóọôồổỗốộơờởỡớợpqrstuùủũúụưừửữứựvwxyỳỷỹýỵz'
-    return re.sub(f'[^{alphabet} ]', '', unicodedata.normalize('NFC', string).lower())
+class HMM:
+    def __init__(self):
+        self.vocabulary = Vocabulary()
+        self.A_counts = array('d', [0, 0, 0, 0])
+        self.B_counts = array('d', [0, 0])
+        self.A = array('d', [0, 0, 0, 0])
+        self.B = array('d', [0, 0])
+        self.π = array('d', [1, 0])
+        self.log_A = array('d', [-math.inf] * 4)
+        self.log_B = array('d', [-math.inf] * 2)
+        self.log_π = array('d', map(log, self.π))
 
-Q = {'B', 'I'}
-A = {'B': {'B': 0, 'I': 0}, 'I': {'B': 0, 'I': 0}}
-B = collections.defaultdict(lambda: collections.defaultdict(int))
-π = {'B': 1, 'I': 0}
-os.chdir('EVBCorpus_EVBNews_v2.0')
-verbose = False
-n = 750 # This is where to draw the line between training and test data.
+    def train(self, syllables, actual_boundaries):
+        # Here, we convert to BI-tags, where 0 is B and 1 is I.
 
-for training_number in range(1, n):
-    print(f'Training... {training_number / n : 5.2%}')
+        actual_bi_tags = [0] + [1 - boundary for boundary in actual_boundaries]
 
-    with open(f'N{training_number:04d}.sgml', 'r') as file:
-        for line in file:
-            if not line.startswith("<spair"):
-                continue
+        # Here, we count conditional frequencies so that we can calculate the A and B matrices later.
 
-            next(file)
-            syllables = normalize(re.sub(r'<.*?>|</s>', '', next(file))).split()
+        for i in range(len(syllables) - 1):
+            self.A_counts[2 * actual_bi_tags[i] + actual_bi_tags[i + 1]] += 1
 
-            # Here, we will get the actual word boundaries from the training data.
+        for syllable, bi_tag in zip(syllables, actual_bi_tags):
+            o = self.vocabulary.add(syllable)
 
-            try:
-                actual_boundaries = [1 for _ in range(len(syllables) - 1)]
-                annotations = re.sub(r'<.*?>|;</a>\n', '', next(file)).split(';')
+            if 2 * o == len(self.B_counts):
+                self.B_counts.extend((0, 0))
 
-                for annotation in annotations:
-                    syllable_indices = [int(_) - 1 for _ in annotation.split('-')[1].split(',')]
+            self.B_counts[2 * o + bi_tag] += 1
 
-                    for i, j in zip(syllable_indices[:-1], syllable_indices[1:]):
-                        if i + 1 == j:
-                            actual_boundaries[i] = 0
+    # Here, we will convert A and B from frequencies to probabilities.
+    # We also keep their logarithms, so that decoding can add log probabilities instead of multiplying probabilities,
+    # which would underflow to 0 on long sentences.
+    # Each row of B only depends on the counts of its own syllable, so after an update only the rows of the given syllables are recomputed.
 
-            except IndexError:
-                continue
+    def estimate(self, observations=None):
+        if observations is None:
+            observations = range(len(self.vocabulary))
 
-            except ValueError:
-                continue
+        for s_0 in range(2):
+            s = self.A_counts[2 * s_0] + self.A_counts[2 * s_0 + 1]
 
-            # Here, we convert to BI-tags.
+            if s:
+                for s_1 in range(2):
+                    self.A[2 * s_0 + s_1] = self.A_counts[2 * s_0 + s_1] / s
+                    self.log_A[2 * s_0 + s_1] = log(self.A[2 * s_0 + s_1])
 
-            actual_bi_tags = [None for _ in range(len(syllables))]
-            actual_bi_tags[0] = 'B'
+        growth = len(self.B_counts) - len(self.B)
+        self.B.extend([0] * growth)
+        self.log_B.extend([-math.inf] * growth)
 
-            for i in range(len(syllables) - 1):
-                actual_bi_tags[i + 1] = 'B' if actual_boundaries[i] else 'I'
+        for o in observations:
+            s = self.B_counts[2 * o] + self.B_counts[2 * o + 1]
 
-            # Here, we count conditional frequencies so that we can calculate the A and B matrices later.
+            if s:
+                for s_1 in range(2):
+                    self.B[2 * o + s_1] = self.B_counts[2 * o + s_1] / s
+                    self.log_B[2 * o + s_1] = log(self.B[2 * o + s_1])
 
-            for i in range(len(syllables) - 1):
-                A[actual_bi_tags[i]][actual_bi_tags[i + 1]] += 1
+    # Here, we add more annotated SGML files to a trained model.
 
-            for i in range(len(syllables)):
-                B[syllables[i]][actual_bi_tags[i]] += 1
+    def update(self, filenames):
+        for name in ('A_counts', 'B_counts', 'A', 'B', 'π', 'log_A', 'log_B', 'log_π'):
+            setattr(self, name, storage.thaw(getattr(self, name)))
 
-            if verbose:
-                print(actual_bi_tags)
+        observations = set()
 
-                for i, syllable in enumerate(syllables):
-                    print(syllable, end=' ')
+        for syllables, actual_boundaries in read_corpus(filenames):
+            self.train(syllables, actual_boundaries)
+            observations.update(self.vocabulary.encode(syllables))
 
-                    if i < len(syllables) - 1:
-                        print(end='| ' if actual_boundaries[i] else '')
+        self.estimate(observations)
 
-                print()
+    # Here, we will posit BI-tags using the Viterbi algorithm in log space.
+    # With only two states, the maximization over the previous state is written out by hand,
+    # and the backpointers are kept in a flat bytearray where backpointer[2 * t + s] is the best previous state for state s at time t.
+    # Ties go to I, like they did when this took the max over (probability, state) pairs.
+    # Long inputs are decoded in chunks of at most MAX_LENGTH syllables, each of which starts with a B,
+    # so they are split before syllables that are more often tagged B than I where possible.
+    # There is no batched decoder: without NumPy, which this project does not depend on, a padded batch would still be decoded
+    # one syllable of one sentence at a time, so callers decode sentences in turn, and throughput comes from the process pools
+    # of segmentation.iter_segment and server.py instead.
 
-# Here, we will convert A and B from frequencies to probabilities.
+    @timed('decoding')
+    def decode(self, syllables):
+        if len(syllables) > MAX_LENGTH:
+            return decode_chunked(self.decode, syllables, self.break_costs, tags=True)
 
-for before in A:
-    s = sum(A[before].values())
+        log_A, log_B, log_π = self.log_A, self.log_B, self.log_π
+        observations = self.vocabulary.encode(syllables)
+        T = len(observations)
 
-    for after in A[before]:
-        A[before][after] /= s
+        if T == 0:
+            return []
 
-for syllable in B:
-    s = sum(B[syllable].values())
+        o = 2 * observations[0]
+        viterbi_B = log_π[0] + log_B[o]
+        viterbi_I = log_π[1] + log_B[o + 1]
+        backpointer = bytearray(2 * T)
 
-    for bi_tag in B[syllable]:
-        B[syllable][bi_tag] /= s
+        for t in range(1, T):
+            o = 2 * observations[t]
+            from_B = viterbi_B + log_A[0] + log_B[o]
+            from_I = viterbi_I + log_A[2] + log_B[o]
 
-# Now, we will test.
+            if from_I >= from_B:
+                next_B = from_I
+                backpointer[2 * t] = 1
 
-true_positives = 0
-false_positives = 0
-true_negatives = 0
-false_negatives = 0
-verbose = False
+            else:
+                next_B = from_B
 
-for test_number in range(n, 1001):
-    print(f'Testing... {(test_number - n) / (1001 - n) : 5.2%}')
+            from_B = viterbi_B + log_A[1] + log_B[o + 1]
+            from_I = viterbi_I + log_A[3] + log_B[o + 1]
 
-    with open(f'N{test_number:04d}.sgml', 'r') as file:
-        for line in file:
-            if not line.startswith("<spair"):
-                continue
+            if from_I >= from_B:
+                next_I = from_I
+                backpointer[2 * t + 1] = 1
 
-            next(file)
-            syllables = normalize(re.sub(r'<.*?>|</s>', '', next(file))).split()
+            else:
+                next_I = from_B
 
-            # Here, we will get the actual word boundaries from the training data.
+            viterbi_B, viterbi_I = next_B, next_I
 
-            try:
-                actual_boundaries = [1 for _ in range(len(syllables) - 1)]
-                annotations = re.sub(r'<.*?>|;</a>\n', '', next(file)).split(';')
+        bestpathpointer = 1 if viterbi_I >= viterbi_B else 0
+        bestpath = [None] * T
 
-                for annotation in annotations:
-                    syllable_indices = [int(_) - 1 for _ in annotation.split('-')[1].split(',')]
+        for t in range(T - 1, -1, -1):
+            bestpath[t] = Q[bestpathpointer]
+            bestpathpointer = backpointer[2 * t + bestpathpointer]
 
-                    for i, j in zip(syllable_indices[:-1], syllable_indices[1:]):
-                        if i + 1 == j:
-                            actual_boundaries[i] = 0
+        return bestpath
 
-            except IndexError:
-                continue
+    def break_costs(self, syllables, start, end):
+        log_B = self.log_B
+        return [0] + [0 if log_B[2 * o] >= log_B[2 * o + 1] else 1 for o in self.vocabulary.encode(syllables[start + 1:end + 1])]
+
+    # Here, we posit word boundaries by choosing the best path through a lattice of candidate words, such as the hybrid decoder's,
+    # scored by the HMM with a log bonus for each edge. A word is tagged B and then I for the rest of its syllables,
+    # so the DP keeps, for each vertex j, the best score of the words up to syllables[j] ending in each state,
+    # in scores[2 * j + s], with backpointer[2 * j + s] = 2 * i + s_0 for the previous vertex i and its state s_0, or -1 if no word reaches it.
+    # The edges starting at a vertex are in order of their ends, so each word's score extends the previous one's.
+    # Syllables that were never seen in training have no emissions, so they get a log emission of 0 in both states,
+    # and the words of the lattice and the transitions decide how they are segmented.
+
+    def decode_lattice(self, syllables, offsets, ends, bonuses=None):
+        log_A, log_π = self.log_A, self.log_π
+        observations = self.vocabulary.encode(syllables)
+        T = len(observations)
+
+        if T == 0:
+            return []
 
-            except ValueError:
+        log_B = array('d', [0.0] * (2 * T))
+
+        for t, o in enumerate(observations):
+            if o:
+                log_B[2 * t] = self.log_B[2 * o]
+                log_B[2 * t + 1] = self.log_B[2 * o + 1]
+
+        scores = array('d', [-math.inf] * (2 * T + 2))
+        backpointer = array('i', [-1] * (2 * T + 2))
+
+        for i in range(T):
+            if i == 0:
+                score, previous = log_π[0], 0
+
+            elif backpointer[2 * i + 1] >= 0 and scores[2 * i + 1] + log_A[2] >= scores[2 * i] + log_A[0]:
+                score, previous = scores[2 * i + 1] + log_A[2], 2 * i + 1
+
+            elif backpointer[2 * i] >= 0:
+                score, previous = scores[2 * i] + log_A[0], 2 * i
+
+            else:
                 continue
 
-            # Here, we convert to BI-tags.
+            score += log_B[2 * i]
+            s = 0
+            t = i + 1
+
+            for k in range(offsets[i], offsets[i + 1]):
+                j = ends[k]
+
+                while t < j:
+                    score += log_A[2 * s + 1] + log_B[2 * t + 1]
+                    s = 1
+                    t += 1
+
+                word_score = score + bonuses[k] if bonuses is not None else score
+
+                if backpointer[2 * j + s] < 0 or scores[2 * j + s] < word_score:
+                    scores[2 * j + s] = word_score
+                    backpointer[2 * j + s] = previous
+
+        state = 2 * T + 1 if backpointer[2 * T + 1] >= 0 and scores[2 * T + 1] >= scores[2 * T] else 2 * T
+        posited_boundaries = [0 for _ in range(T - 1)]
+
+        while state >> 1 > 0:
+            state = backpointer[state]
+
+            if state >> 1 > 0:
+                posited_boundaries[(state >> 1) - 1] = 1
+
+        return posited_boundaries
+
+    # Here, we find the k most probable BI-tag sequences, with their log probabilities, best first.
+    # Instead of one best path, each state at each time keeps its k best paths as (log probability, previous state, rank of the path there).
+    # Paths through I are listed first, so that ties go to I like in decode.
+    # Paths only start from states that can start a sentence, and paths with probability 0 are dropped on the way,
+    # so every path is a possible tagging. Syllables that were never seen in training get a log emission of 0 in both states, like in decode_lattice.
+    # The first tag is always a boundary, so two paths that only differ in it are the same segmentation,
+    # which can only happen when both states can start a sentence; then twice as many paths are kept, and only the best of each segmentation is returned.
 
-            actual_bi_tags = [None for _ in range(len(syllables))]
-            actual_bi_tags[0] = 'B'
+    def decode_nbest(self, syllables, k):
+        log_A, log_π = self.log_A, self.log_π
+        observations = self.vocabulary.encode(syllables)
+        T = len(observations)
 
-            for i in range(len(syllables) - 1):
-                actual_bi_tags[i + 1] = 'B' if actual_boundaries[i] else 'I'
+        if T == 0:
+            return [(0.0, [])]
 
-            # Here, we will posit word boundaries using the HMM we just trained and the Viterbi algorithm.
-            # Again, I try to follow the notation in the pseudocode given in Jurafsky and Martin.
+        log_B = array('d', [0.0] * (2 * T))
 
-            viterbi = {}
-            backpointer = {}
+        for t, o in enumerate(observations):
+            if o:
+                log_B[2 * t] = self.log_B[2 * o]
+                log_B[2 * t + 1] = self.log_B[2 * o + 1]
 
-            for s in Q:
-                viterbi[(s, 0)] = π[s] * B[syllables[0]][s]
-                backpointer[(s, 0)] = None
+        starts = [s for s in range(2) if log_π[s] > -math.inf]
+        width = k * len(starts)
+        paths = [[[(log_π[s] + log_B[s], None, None)] if s in starts and log_B[s] > -math.inf else [] for s in range(2)]]
 
-            T = len(syllables)
+        for t in range(1, T):
+            column = []
 
-            for t in range(1, T):
-                for s in Q:
-                    viterbi[(s, t)], backpointer[(s, t)] = max([(viterbi[(s_0, t - 1)] * A[s_0][s] * B[syllables[t]][s], s_0) for s_0 in Q])
+            for s in range(2):
+                candidates = [(path[0] + log_A[2 * s_0 + s] + log_B[2 * t + s], s_0, r) for s_0 in (1, 0) for r, path in enumerate(paths[t - 1][s_0])]
+                column.append(heapq.nlargest(width, [candidate for candidate in candidates if candidate[0] > -math.inf], key=lambda candidate: candidate[0]))
 
-            bestpathprob, bestpathpointer = max([(viterbi[(s, T - 1)], s) for s in Q])
-            bestpath = []
+            paths.append(column)
+
+        best = heapq.nlargest(width, [(path[0], s, r) for s in (1, 0) for r, path in enumerate(paths[T - 1][s])], key=lambda candidate: candidate[0])
+        results = []
+        segmentations = set()
+
+        for bestpathprob, s, r in best:
+            bestpath = [None] * T
 
             for t in range(T - 1, -1, -1):
-                bestpath.append(bestpathpointer)
-                bestpathpointer = backpointer[(bestpathpointer, t)]
+                bestpath[t] = Q[s]
+                _, s, r = paths[t][s][r]
 
-            bestpath.reverse()
-            posited_bi_tags = bestpath
+            if tuple(bestpath[1:]) not in segmentations and len(results) < k:
+                segmentations.add(tuple(bestpath[1:]))
+                results.append((bestpathprob, bestpath))
 
-            # Here, we will count true/false positives/negatives.
+        return results
+
+    # Here, we export the whole scored trellis of a sentence, so that it can be decoded or reranked elsewhere.
+    # Impossible transitions and emissions, with log probability -inf, are given as None.
+
+    def lattice(self, syllables):
+        observations = self.vocabulary.encode(syllables)
+
+        return {
+            'syllables': syllables,
+            'states': Q,
+            'initial': [finite(self.log_π[s]) for s in range(2)],
+            'transitions': [[finite(self.log_A[2 * s_0 + s]) for s in range(2)] for s_0 in range(2)],
+            'emissions': [[finite(self.log_B[2 * o + s]) for s in range(2)] for o in observations]
+        }
+
+    # Here, we save the trained model, or load it with the arrays memory-mapped from the file.
+    # A loaded model is read-only until it is updated, which copies the arrays into memory.
+
+    def save(self, filename):
+        storage.save(filename, 'hmm', {
+            'vocabulary': self.vocabulary,
+            'A_counts': self.A_counts,
+            'B_counts': self.B_counts,
+            'A': self.A,
+            'B': self.B,
+            'π': self.π,
+            'log_A': self.log_A,
+            'log_B': self.log_B,
+            'log_π': self.log_π
+        })
+
+    @classmethod
+    def load(cls, filename):
+        hmm = cls()
+
+        for name, section in storage.load(filename, 'hmm').items():
+            setattr(hmm, name, section)
+
+        return hmm
+
+def log(probability):
+    return math.log(probability) if probability > 0 else -math.inf
+
+def finite(log_probability):
+    return log_probability if log_probability > -math.inf else None
+
+if __name__ == '__main__':
+    # First, we will train, unless there is already a trained model.
+
+    model_filename = os.path.abspath('hmm.model')
+    os.chdir('EVBCorpus_EVBNews_v2.0')
+    verbose = False
+    n = 750 # This is where to draw the line between training and test data.
+
+    if not os.path.exists(model_filename):
+        hmm = HMM()
 
-            for i in range(len(syllables) - 1):
-                if actual_bi_tags[i] == posited_bi_tags[i]:
-                    if posited_bi_tags[i] == 'B':
-                        true_positives += 1
+        for training_number in range(1, n):
+            progress(f'Training... {training_number / n : 5.2%}')
 
-                    else:
-                        true_negatives += 1
+            for syllables, actual_boundaries in read_sgml(f'N{training_number:04d}.sgml', cache=True):
+                hmm.train(syllables, actual_boundaries)
 
-                else:
-                    if posited_bi_tags[i] == 'B':
-                        false_positives += 1
+                if verbose:
+                    for i, syllable in enumerate(syllables):
+                        print(syllable, end=' ')
+
+                        if i < len(syllables) - 1:
+                            print(end='| ' if actual_boundaries[i] else '')
+
+                    print()
+
+        hmm.estimate()
+        hmm.save(model_filename)
+
+    hmm = HMM.load(model_filename)
+
+    # Now, we will test.
+
+    evaluation = Evaluation()
+    verbose = False
+
+    for test_number in range(n, 1001):
+        progress(f'Testing... {(test_number - n) / (1001 - n) : 5.2%}')
+
+        filename = f'N{test_number:04d}.sgml'
+
+        for syllables, actual_boundaries in read_sgml(filename, cache=True):
+            # Here, we convert to BI-tags.
+
+            actual_bi_tags = ['B'] + ['B' if boundary else 'I' for boundary in actual_boundaries]
+
+            # Here, we will posit word boundaries using the HMM we just trained.
+
+            posited_bi_tags = hmm.decode(syllables)
+
+            # Here, we will count true/false positives/negatives.
+            # The tag of the first syllable is always B, so the boundary after syllables[i] is the tag of syllables[i + 1].
 
-                    else:
-                        false_negatives += 1
+            evaluation.add(actual_boundaries, [1 if bi_tag == 'B' else 0 for bi_tag in posited_bi_tags[1:]], filename, len(syllables))
 
             if verbose:
                 print(actual_bi_tags)
@@ -199,11 +397,4 @@ for test_number in range(n, 1001):
 
                 print()
 
-accuracy = (true_positives + true_negatives) / (true_positives + true_negatives + false_positives + false_negatives)
-precision = true_positives / (true_positives + false_positives)
-recall = true_positives / (true_positives + false_negatives)
-f1 = (2 * precision * recall) / (precision + recall)
-print('Accuracy:', accuracy)
-print('Precision:', precision)
-print('Recall:', recall)
-print('F1:', f1)
+    evaluation.print()
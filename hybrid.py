@@ -0,0 +1,89 @@
+import os
+from array import array
+import graphs
+import hmm
+from chunking import MAX_LENGTH, crossings, decode_chunked
+from corpus import read_sgml
+from evaluation import Evaluation
+from instrumentation import progress, timed
+from normalization import normalize
+from trie import build_lattice, build_trie, read_words
+from vocabulary import UNKNOWN
+
+# This decodes with a lattice of candidate words from both a dictionary, such as Viet74K, and a trained model,
+# and scores the paths through it with the model: the bigram model of graphs.py, or the HMM of hmm.py.
+# For the bigram model, the candidates are the words of the dictionary and of the model's vocabulary,
+# so compounds that never came up in training can still be posited, and are scored like unknown words.
+# The HMM has no vocabulary of words, so its candidates are the words of the dictionary, and it chooses between them.
+# Every single syllable is also a candidate.
+# Multi-syllable words of the dictionary can be given a log bonus, to lean more or less on the dictionary.
+#
+# Both sets of words are put in one trie when the decoder is made, where each word maps to its index in tokens,
+# with ids[index] its ID in the model and in_dictionary[index] whether it is in the dictionary,
+# so each sentence only needs one walk of the trie, like the plain bigram decoder.
+
+class HybridDecoder:
+    def __init__(self, model, dictionary, bonus=0.0):
+        self.model = model
+        self.bonus = bonus
+        self.tokens = list(model.vocabulary.tokens) if isinstance(model, graphs.BigramModel) else ['<unk>']
+        self.ids = array('i', range(len(self.tokens))) if isinstance(model, graphs.BigramModel) else array('i', [UNKNOWN])
+        dictionary = dict.fromkeys(dictionary)
+        self.in_dictionary = bytearray(token in dictionary for token in self.tokens)
+        known = set(self.tokens)
+
+        for word in dictionary:
+            if word not in known:
+                self.tokens.append(word)
+                self.ids.append(UNKNOWN)
+                self.in_dictionary.append(1)
+
+        self.trie = build_trie(self.tokens)
+
+    @timed('decoding')
+    def decode(self, syllables):
+        if len(syllables) > MAX_LENGTH:
+            return decode_chunked(self.decode, syllables, crossings(self.trie))
+
+        offsets, ends, words = build_lattice(self.trie, syllables, UNKNOWN)
+        bonuses = None
+
+        if self.bonus:
+            bonuses = array('d', [0] * len(ends))
+
+            for i in range(len(syllables)):
+                for k in range(offsets[i] + 1, offsets[i + 1]):
+                    if self.in_dictionary[words[k]]:
+                        bonuses[k] = self.bonus
+
+        if isinstance(self.model, graphs.BigramModel):
+            return self.model.scorer().decode_lattice(syllables, offsets, ends, array('i', [self.ids[word] for word in words]), bonuses)
+
+        return self.model.decode_lattice(syllables, offsets, ends, bonuses)
+
+if __name__ == '__main__':
+    # First, we will load the models that graphs.py and hmm.py trained.
+
+    graphs_model = graphs.BigramModel.load(os.path.abspath('graphs.model'))
+    hmm_model = hmm.HMM.load(os.path.abspath('hmm.model'))
+    dictionary = read_words('Viet74K.txt', normalize)
+    decoders = {'graphs': HybridDecoder(graphs_model, dictionary), 'hmm': HybridDecoder(hmm_model, dictionary)}
+
+    os.chdir('EVBCorpus_EVBNews_v2.0')
+
+    # Now, we will test.
+
+    evaluations = {name: Evaluation() for name in decoders}
+
+    for test_number in range(750, 1001):
+        progress(f'Testing... {(test_number - 750) / (1001 - 750):5.2%}')
+
+        filename = f'N{test_number:04d}.sgml'
+
+        for syllables, actual_boundaries in read_sgml(filename, cache=True):
+            for name, decoder in decoders.items():
+                evaluations[name].add(actual_boundaries, decoder.decode(syllables), filename, len(syllables))
+
+    for name, evaluation in evaluations.items():
+        print(f'{name}:')
+        evaluation.print()
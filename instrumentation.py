@@ -0,0 +1,180 @@
+import atexit
+import collections
+import cProfile
+import functools
+import inspect
+import io
+import json
+import multiprocessing
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+
+# This is opt-in instrumentation for the segmenters, configured by environment variables:
+#
+#     WSEG_PROFILE         a comma-separated list of what to collect:
+#                              stages       calls, items, and time spent in each stage, such as parsing, normalization, lattice, decoding, and evaluation
+#                                           both in the stage itself and in total, with the stages it calls
+#                              cprofile     a cProfile of the whole run
+#                              tracemalloc  the peak traced memory and the lines that allocated the most
+#                          or all for all of them
+#     WSEG_PROFILE_OUTPUT  the file to write the summary to as JSON when the process exits (default: standard error)
+#
+# Stages are marked by decorating functions with @timed. Without WSEG_PROFILE=stages, @timed returns the function itself,
+# so the hot paths pay nothing unless instrumentation is on. The summary only covers the main process, not pool workers.
+
+options = {option.strip() for option in os.environ.get('WSEG_PROFILE', '').split(',') if option.strip()}
+
+if 'all' in options or '1' in options:
+    options = {'stages', 'cprofile', 'tracemalloc'}
+
+enabled = 'stages' in options
+
+# stages[name] is [calls, items, seconds, total seconds], where items are what a generator yielded, or the calls of a function.
+# Stages nest, such as normalization inside parsing, or decoding inside decoding when a long input is decoded in chunks,
+# so seconds is the time spent in the stage itself, without the stages it called, and the seconds of all the stages add up to the time in any of them.
+# Total seconds also counts the stages it called, and only the outermost call of a stage that calls itself.
+# Each thread keeps a stack of the time spent in the stages called by each stage that is running.
+
+stages = collections.defaultdict(lambda: [0, 0, 0.0, 0.0])
+counters = collections.Counter()
+local = threading.local()
+
+def enter(name):
+    if not hasattr(local, 'nested'):
+        local.nested = [0.0]
+        local.running = collections.Counter()
+
+    local.nested.append(0.0)
+    local.running[name] += 1
+
+def leave(name, stage, seconds):
+    nested = local.nested.pop()
+    local.nested[-1] += seconds
+    local.running[name] -= 1
+    stage[2] += seconds - nested
+
+    if not local.running[name]:
+        stage[3] += seconds
+
+def timed(name):
+    def decorate(function):
+        if not enabled:
+            return function
+
+        if inspect.isgeneratorfunction(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                stage = stages[name]
+                stage[0] += 1
+                iterator = function(*args, **kwargs)
+
+                while True:
+                    enter(name)
+                    start = time.perf_counter()
+
+                    try:
+                        item = next(iterator)
+
+                    except StopIteration:
+                        return
+
+                    finally:
+                        leave(name, stage, time.perf_counter() - start)
+
+                    stage[1] += 1
+                    yield item
+
+        else:
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                stage = stages[name]
+                enter(name)
+                start = time.perf_counter()
+
+                try:
+                    return function(*args, **kwargs)
+
+                finally:
+                    leave(name, stage, time.perf_counter() - start)
+                    stage[0] += 1
+                    stage[1] += 1
+
+        return wrapper
+
+    return decorate
+
+def count(name, value=1):
+    counters[name] += value
+
+# Here, we print a progress message at most once a second, or whenever final is true,
+# so that progress reports do not slow down loops over many small files.
+
+last_progress = 0
+
+def progress(message, final=False):
+    global last_progress
+
+    if final or time.monotonic() - last_progress >= 1:
+        print(message)
+        last_progress = time.monotonic()
+
+profiler = None
+
+if 'cprofile' in options:
+    profiler = cProfile.Profile()
+    profiler.enable()
+
+if 'tracemalloc' in options:
+    tracemalloc.start()
+
+def summary(limit=30):
+    summary = {
+        'stages': {name: {'calls': calls, 'items': items, 'seconds': seconds, 'total_seconds': total_seconds} for name, (calls, items, seconds, total_seconds) in sorted(stages.items())},
+        'counters': dict(counters)
+    }
+
+    if profiler is not None:
+        profiler.disable()
+        statistics = pstats.Stats(profiler, stream=io.StringIO())
+        rows = sorted(statistics.stats.items(), key=lambda row: row[1][3], reverse=True)[:limit]
+
+        summary['profile'] = [{
+            'function': f'{filename}:{line}({function})',
+            'calls': calls,
+            'total_seconds': total_seconds,
+            'cumulative_seconds': cumulative_seconds
+        } for (filename, line, function), (primitive_calls, calls, total_seconds, cumulative_seconds, callers) in rows]
+
+        profiler.enable()
+
+    if tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+
+        summary['memory'] = {
+            'current_bytes': current,
+            'peak_bytes': peak,
+            'top': [{'location': str(statistic.traceback[0]), 'bytes': statistic.size, 'blocks': statistic.count} for statistic in tracemalloc.take_snapshot().statistics('lineno')[:limit]]
+        }
+
+    return summary
+
+def write_summary():
+    if multiprocessing.parent_process() is not None:
+        return
+
+    data = json.dumps(summary(), indent=4)
+    filename = os.environ.get('WSEG_PROFILE_OUTPUT')
+
+    if filename:
+        with open(filename, 'w') as file:
+            file.write(data)
+
+    else:
+        print(data, file=sys.stderr)
+
+if options:
+    atexit.register(write_summary)
@@ -1,105 +1,53 @@
-import collections
-import math
-import pickle
 import os
-import re
-import unicodedata
+from corpus import join_words, read_sgml
+from evaluation import Evaluation
+from instrumentation import progress, timed
+from normalization import normalize
+from trie import greedy_match, load_trie
 
-# First, we will train.
+# Here, we posit words based on choosing the largest possible words from a dictionary.
+# The dictionary is a syllable trie, so each word is found by walking it without building any strings.
 
-def normalize(string):
-    alphabet = 'aàảãáạăằẳẵắặâầẩẫấậbcdđeèẻẽéẹêềểễếệfghiìỉĩíịjklmnoòỏõóọôồổỗốộơờởỡớợpqrstuùủũúụưừửữứựvwxyỳỷỹýỵz'
-    return re.sub(f'[^{alphabet} ]', '', unicodedata.normalize('NFC', string).lower())
+@timed('decoding')
+def decode(dictionary, syllables):
+    posited_boundaries = [0 for _ in range(len(syllables) - 1)]
+    i = 0
 
-with open('Viet74K.txt', 'r') as file:
-    dictionary = {normalize(line) for line in file}
+    while i < len(syllables):
+        i = greedy_match(dictionary, syllables, i)
 
-os.chdir('EVBCorpus_EVBNews_v2.0')
+        if i < len(syllables):
+            posited_boundaries[i - 1] = 1
 
-# Now, we will test.
+    return posited_boundaries
 
-true_positives = 0
-false_positives = 0
-true_negatives = 0
-false_negatives = 0
+if __name__ == '__main__':
+    dictionary = load_trie('Viet74K.txt', normalize)
 
-for test_number in range(750, 751):
-    print(f'Testing... {(test_number - 750) / (1001 - 750):5.2%}')
+    os.chdir('EVBCorpus_EVBNews_v2.0')
 
-    with open(f'N{test_number:04d}.sgml', 'r') as file:
-        for line in file:
-            if not line.startswith("<spair"):
-                continue
+    # Now, we will test.
 
-            next(file)
-            syllables = normalize(re.sub(r'<.*?>|</s>', '', next(file))).split()
+    evaluation = Evaluation()
 
-            # Here, we will get the actual word boundaries from the training data.
+    for test_number in range(750, 751):
+        progress(f'Testing... {(test_number - 750) / (1001 - 750):5.2%}')
 
-            try:
-                actual_boundaries = [1 for _ in range(len(syllables) - 1)]
-                annotations = re.sub(r'<.*?>|;</a>\n', '', next(file)).split(';')
+        filename = f'N{test_number:04d}.sgml'
 
-                for annotation in annotations:
-                    syllable_indices = [int(_) - 1 for _ in annotation.split('-')[1].split(',')]
+        for syllables, actual_boundaries in read_sgml(filename, cache=True):
+            posited_boundaries = decode(dictionary, syllables)
 
-                    for i, j in zip(syllable_indices[:-1], syllable_indices[1:]):
-                        if i + 1 == j:
-                            actual_boundaries[i] = 0
-
-            except IndexError:
-                continue
-
-            except ValueError:
-                continue
-
-            # Here, we posit words based on choosing the largest possible words from a dictionary.
-
-            posited_boundaries = [0 for _ in range(len(syllables) - 1)]
-            posited_words = []
-            word = ''
-
-            for i in range(len(syllables)):
-                if word != '' and ' '.join([word, syllables[i]]).strip() not in dictionary:
-                    posited_boundaries[i - 1] = 1
-                    posited_words.append(word)
-                    word = ''
-
-                word = ' '.join([word, syllables[i]]).strip()
-
-            # Here, we will count true/false positives/negatives.
-
-            for i in range(len(syllables) - 1):
-                if actual_boundaries[i] == posited_boundaries[i]:
-                    if posited_boundaries[i] == 1:
-                        true_positives += 1
-
-                    else:
-                        true_negatives += 1
-
-                else:
-                    if posited_boundaries[i] == 1:
-                        false_positives += 1
-
-                    else:
-                        false_negatives += 1
+            evaluation.add(actual_boundaries, posited_boundaries, filename, len(syllables))
 
             print(syllables)
-            # print(words)
-            print(posited_words)
+            # print(join_words(syllables, actual_boundaries))
+            print(join_words(syllables, posited_boundaries))
             # print(actual_boundaries)
             # print(posited_boundaries)
             #
             # print()
 
-# Here, we will calculate the accuracy, precision, recall, and F1.
-
-accuracy = (true_positives + true_negatives) / (true_positives + true_negatives + false_positives + false_negatives)
-precision = true_positives / (true_positives + false_positives)
-recall = true_positives / (true_positives + false_negatives)
-f1 = (2 * precision * recall) / (precision + recall)
-print('Accuracy:', accuracy)
-print('Precision:', precision)
-print('Recall:', recall)
-print('F1:', f1)
+    # Here, we will calculate the accuracy, precision, recall, and F1.
 
+    evaluation.print()
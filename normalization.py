@@ -0,0 +1,28 @@
+import functools
+import re
+import unicodedata
+from instrumentation import timed
+
+# This is the normalization shared by all of the segmenters:
+# text is put in NFC form and lowercased, and everything except Vietnamese letters and spaces is removed.
+# The pattern is compiled once, and text that is already in NFC form, which is most text, skips that step.
+
+alphabet = 'aàảãáạăằẳẵắặâầẩẫấậbcdđeèẻẽéẹêềểễếệfghiìỉĩíịjklmnoòỏõóọôồổỗốộơờởỡớợpqrstuùủũúụưừửữứựvwxyỳỷỹýỵz'
+pattern = re.compile(f'[^{alphabet} ]+')
+
+@timed('normalization')
+def normalize(string):
+    if not unicodedata.is_normalized('NFC', string):
+        string = unicodedata.normalize('NFC', string)
+
+    return pattern.sub('', string.lower())
+
+# Here, we keep the normalizations of recent short strings, such as words or headlines that repeat a lot,
+# in a bounded LRU cache. Long strings rarely repeat, so they are not cached.
+
+@functools.lru_cache(maxsize=65536)
+def normalize_short(string):
+    return normalize(string)
+
+def normalize_cached(string):
+    return normalize_short(string) if len(string) <= 64 else normalize(string)
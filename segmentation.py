@@ -0,0 +1,238 @@
+import argparse
+import collections
+import functools
+import io
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import sys
+import graphs
+import hmm
+import hybrid
+import instrumentation
+import maximal_matching
+import transitional_frequencies
+import trigram_hmm
+from cache import CachedDecoder
+from chunking import segment_text
+from corpus import join_words
+from normalization import normalize
+from trie import load_trie, read_words
+
+# This is the library entry point for segmenting raw sentences with any of the four methods.
+# Each method needs a trained model, which is loaded from a file once per process and then kept:
+# the dictionary for maximal matching, and the model files that hmm.py, trigram_hmm.py, graphs.py, and transitional_frequencies.py save.
+# The hybrid methods decode with the bigram model or the HMM over a lattice that also has the words of the dictionary,
+# which is the one given, or the maximal matching one by default.
+
+METHODS = ['maximal_matching', 'hmm', 'trigram_hmm', 'graphs', 'transitional_frequencies', 'hybrid_graphs', 'hybrid_hmm']
+
+default_filenames = {
+    'maximal_matching': 'Viet74K.txt',
+    'hmm': 'hmm.model',
+    'trigram_hmm': 'trigram_hmm.model',
+    'graphs': 'graphs.model',
+    'transitional_frequencies': 'transitional_frequencies.model',
+    'hybrid_graphs': 'graphs.model',
+    'hybrid_hmm': 'hmm.model'
+}
+
+models = {}
+
+def load(method, filename=None, dictionary=None):
+    if method not in default_filenames:
+        raise ValueError(f'Unknown segmentation method {method!r}, expected one of {", ".join(METHODS)}')
+
+    key = (method, os.path.abspath(filename or default_filenames[method]))
+
+    if method.startswith('hybrid_'):
+        key += (os.path.abspath(dictionary or default_filenames['maximal_matching']),)
+
+    if key not in models:
+        if method.startswith('hybrid_'):
+            models[key] = hybrid.HybridDecoder(load(method[len('hybrid_'):], key[1]), read_words(key[2], normalize))
+
+        elif method == 'maximal_matching':
+            models[key] = load_trie(key[1], normalize)
+
+        elif method == 'hmm':
+            models[key] = hmm.HMM.load(key[1])
+
+        elif method == 'trigram_hmm':
+            models[key] = trigram_hmm.TrigramHMM.load(key[1])
+
+        elif method == 'graphs':
+            models[key] = graphs.BigramModel.load(key[1])
+
+        else:
+            models[key] = transitional_frequencies.TransitionalModel.load(key[1])
+
+    return models[key]
+
+# Here, we posit word boundaries for a list of syllables, where boundaries[i] is 1 if there is a word boundary between syllables[i] and syllables[i + 1].
+
+def posit_boundaries(method, model, syllables):
+    if method == 'maximal_matching':
+        return maximal_matching.decode(model, syllables)
+
+    if method == 'hmm':
+        return [1 if bi_tag == 'B' else 0 for bi_tag in model.decode(syllables)[1:]]
+
+    if method == 'trigram_hmm':
+        return trigram_hmm.to_boundaries(model.decode(syllables))
+
+    return model.decode(syllables)
+
+# Here, we get a bounded LRU cache of segmentations in front of a model, which is kept like the model itself.
+
+caches = {}
+
+def load_cache(method, filename=None, cache_size=65536, clauses=False, dictionary=None):
+    key = (method, filename, cache_size, clauses, dictionary)
+
+    if key not in caches:
+        caches[key] = CachedDecoder(functools.partial(posit_boundaries, method, load(method, filename, dictionary)), cache_size, clauses)
+
+    return caches[key]
+
+# Here, we segment one sentence. The output is one of:
+#
+#     words       the list of words
+#     boundaries  the syllables and the word boundaries
+#     nbest       the syllables and the k best (log probability, word boundaries) pairs, best first
+#     lattice     the whole scored lattice, as a dict that can be written as JSON
+#
+# Only the methods in LATTICE_METHODS can give n-best lists and lattices.
+# Words and boundaries can go through a cache of segmentations, which is then what normalizes the sentence.
+
+OUTPUTS = ['words', 'boundaries', 'nbest', 'lattice']
+LATTICE_METHODS = ['hmm', 'graphs']
+
+def segment_sentence(method, model, sentence, output='words', k=1, cache=None):
+    if output in ('nbest', 'lattice') and method not in LATTICE_METHODS:
+        raise ValueError(f'The {method} method cannot give {output} output')
+
+    # A long sentence is split into clauses at its punctuation first, the same way with or without a cache.
+
+    if cache is not None and output in ('words', 'boundaries'):
+        syllables, boundaries = cache.segment(sentence)
+
+    elif output in ('words', 'boundaries'):
+        syllables, boundaries = segment_text(sentence, functools.partial(posit_boundaries, method, model))
+
+    else:
+        syllables = normalize(sentence).split()
+
+    if instrumentation.enabled:
+        instrumentation.count('sentences')
+        instrumentation.count('syllables', len(syllables))
+
+    if output == 'lattice':
+        return model.lattice(syllables)
+
+    if output == 'nbest':
+        if method == 'hmm':
+            return syllables, [(score, [1 if bi_tag == 'B' else 0 for bi_tag in bi_tags[1:]]) for score, bi_tags in model.decode_nbest(syllables, k)]
+
+        return syllables, model.decode_nbest(syllables, k)
+
+    if output == 'words':
+        return join_words(syllables, boundaries) if syllables else []
+
+    return syllables, boundaries
+
+def segment_chunk(method, filename, sentences, output='words', k=1, cache_size=0, clauses=False, dictionary=None):
+    model = load(method, filename, dictionary)
+    cache = load_cache(method, filename, cache_size, clauses, dictionary) if cache_size else None
+    return [segment_sentence(method, model, sentence, output, k, cache) for sentence in sentences]
+
+# Here, we segment sentences lazily, yielding the output for each sentence in order.
+# With more than one worker, the sentences are sent to a process pool in chunks, and each worker loads the model when it starts.
+# Only a few chunks per worker are in flight at a time, so memory stays bounded however many sentences there are.
+# With a cache size, segmentations are cached, by sentence or by clause, in each process.
+
+def iter_segment(sentences, method='hmm', workers=1, filename=None, chunksize=256, output='words', k=1, cache_size=0, clauses=False, dictionary=None):
+    sentences = iter(sentences)
+
+    if output not in OUTPUTS:
+        raise ValueError(f'Unknown output {output!r}, expected one of {", ".join(OUTPUTS)}')
+
+    if workers <= 1:
+        model = load(method, filename, dictionary)
+        cache = load_cache(method, filename, cache_size, clauses, dictionary) if cache_size else None
+
+        for sentence in sentences:
+            yield segment_sentence(method, model, sentence, output, k, cache)
+
+        return
+
+    # Loading the model here checks the method and the file before any workers start, and forked workers inherit it.
+
+    load(method, filename, dictionary)
+    chunks = iter(lambda: list(itertools.islice(sentences, chunksize)), [])
+
+    with multiprocessing.Pool(workers, initializer=load, initargs=(method, filename, dictionary)) as pool:
+        pending = collections.deque()
+
+        for chunk in chunks:
+            pending.append(pool.apply_async(segment_chunk, (method, filename, chunk, output, k, cache_size, clauses, dictionary)))
+
+            if len(pending) >= 2 * workers:
+                yield from pending.popleft().get()
+
+        while pending:
+            yield from pending.popleft().get()
+
+def segment(sentences, method='hmm', workers=1, filename=None, chunksize=256, output='words', k=1, cache_size=0, clauses=False, dictionary=None):
+    return list(iter_segment(sentences, method, workers, filename, chunksize, output, k, cache_size, clauses, dictionary))
+
+# Here, we segment raw text from a file or standard input, one sentence per line, and stream the results to standard output.
+# Words are written with their syllables joined by underscores.
+# Everything else is written as JSON lines: the syllables and the word boundaries, the n-best list, or the lattice.
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description='Segment Vietnamese text into words, one sentence per line.')
+    parser.add_argument('input', nargs='?', type=argparse.FileType('r', encoding='utf-8'), help='the file to segment (default: standard input)')
+    parser.add_argument('-m', '--method', choices=METHODS, default='hmm', help='the segmentation method (default: hmm)')
+    parser.add_argument('-f', '--filename', help='the model file, or the dictionary for maximal matching')
+    parser.add_argument('-d', '--dictionary', help='the dictionary for the hybrid methods (default: Viet74K.txt)')
+    parser.add_argument('-w', '--workers', type=int, default=1, help='the number of worker processes (default: 1)')
+    parser.add_argument('--format', choices=['words', 'jsonl', 'nbest', 'lattice'], default='words', help='the output format (default: words)')
+    parser.add_argument('-k', type=int, default=5, help='the number of segmentations for the nbest format (default: 5)')
+    parser.add_argument('--cache', type=int, default=0, metavar='SIZE', help='cache up to this many segmentations (default: 0, no cache)')
+    parser.add_argument('--clauses', action='store_true', help='cache clauses split at punctuation instead of whole sentences')
+    arguments = parser.parse_args(arguments)
+    output = {'words': 'words', 'jsonl': 'boundaries', 'nbest': 'nbest', 'lattice': 'lattice'}[arguments.format]
+
+    if output in ('nbest', 'lattice') and arguments.method not in LATTICE_METHODS:
+        parser.error(f'the {arguments.format} format needs one of the methods {", ".join(LATTICE_METHODS)}, not {arguments.method}')
+
+    # Standard input is read as UTF-8 like a file, whatever the locale is.
+
+    input = arguments.input or io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8')
+    sentences = (line.rstrip('\n') for line in input)
+
+    for result in iter_segment(sentences, arguments.method, arguments.workers, arguments.filename, output=output, k=arguments.k, cache_size=arguments.cache, clauses=arguments.clauses, dictionary=arguments.dictionary):
+        if output == 'words':
+            print(' '.join(word.replace(' ', '_') for word in result))
+
+        elif output == 'boundaries':
+            syllables, boundaries = result
+            print(json.dumps({'syllables': syllables, 'boundaries': boundaries}, ensure_ascii=False))
+
+        elif output == 'nbest':
+            syllables, nbest = result
+            print(json.dumps({'syllables': syllables, 'nbest': [{'score': score if score > -math.inf else None, 'boundaries': boundaries} for score, boundaries in nbest]}, ensure_ascii=False))
+
+        else:
+            print(json.dumps(result, ensure_ascii=False))
+
+    # The cache statistics are only known here when the sentences were segmented in this process.
+
+    if arguments.cache and arguments.workers <= 1:
+        print(json.dumps(load_cache(arguments.method, arguments.filename, arguments.cache, arguments.clauses, arguments.dictionary).stats()), file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,228 @@
+import argparse
+import asyncio
+import concurrent.futures
+import functools
+import json
+import multiprocessing
+import segmentation
+
+# This is a small HTTP server that keeps a segmentation model loaded and segments sentences for other programs.
+# It listens on a TCP port or a Unix socket and answers:
+#
+#     POST /segment  with a JSON body {"sentences": [...]} or {"text": "..."}, with the words of each sentence, or of the text
+#     GET /health    with the method, the number of sentences and batches so far, and the hit rate of the cache of segmentations
+#
+# Sentences from concurrent requests are collected into micro-batches: a batch is sent off when it is full,
+# or when the window since its first sentence has passed, and it is segmented by segmentation.segment_chunk in an executor,
+# so that the event loop keeps accepting requests while a batch is decoded.
+# With more than one worker, the executor is a process pool, and each worker loads the model when it starts.
+# Up to one batch per worker is decoded at a time, and while all the workers are busy, sentences wait in the queue for the next batch.
+
+class Batcher:
+    def __init__(self, method, filename=None, executor=None, window=0.005, max_batch=256, cache_size=0, clauses=False, workers=1, dictionary=None):
+        self.method = method
+        self.dictionary = dictionary
+        self.filename = filename
+        self.cache_size = cache_size
+        self.clauses = clauses
+        self.executor = executor
+        self.window = window
+        self.max_batch = max_batch
+        self.queue = asyncio.Queue()
+        self.workers = workers
+        self.tasks = set()
+        self.batches = 0
+        self.sentences = 0
+
+    async def segment(self, sentences):
+        futures = []
+
+        for sentence in sentences:
+            future = asyncio.get_running_loop().create_future()
+            await self.queue.put((sentence, future))
+            futures.append(future)
+
+        return await asyncio.gather(*futures)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        in_flight = asyncio.Semaphore(self.workers)
+
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.window
+
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+
+                if timeout <= 0:
+                    break
+
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+
+                except asyncio.TimeoutError:
+                    break
+
+            await in_flight.acquire()
+            self.batches += 1
+            self.sentences += len(batch)
+            task = asyncio.create_task(self.decode(batch, in_flight))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    # Here, we decode one batch in the executor and resolve the futures of its sentences.
+
+    async def decode(self, batch, in_flight):
+        chunk = functools.partial(segmentation.segment_chunk, self.method, self.filename, [sentence for sentence, future in batch], cache_size=self.cache_size, clauses=self.clauses, dictionary=self.dictionary)
+
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(self.executor, chunk)
+
+        except Exception as exception:
+            for sentence, future in batch:
+                if not future.done():
+                    future.set_exception(exception)
+
+            return
+
+        finally:
+            in_flight.release()
+
+        for (sentence, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+# Here, we handle the HTTP requests on one connection, keeping it open between requests unless the client asks to close it.
+
+async def handle(batcher, reader, writer):
+    try:
+        while True:
+            request_line = await reader.readline()
+
+            if not request_line:
+                break
+
+            headers = {}
+
+            while True:
+                line = await reader.readline()
+
+                if line in (b'\r\n', b'\n', b''):
+                    break
+
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+
+            try:
+                method, path, version = request_line.decode('latin-1').split()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+                status, response = await respond(batcher, method, path, body)
+
+            except (ValueError, KeyError, TypeError) as exception:
+                status, response = 400, {'error': str(exception)}
+
+            # Anything else went wrong on our side, such as a worker of the process pool dying.
+
+            except Exception as exception:
+                status, response = 500, {'error': f'{type(exception).__name__}: {exception}'}
+
+            data = json.dumps(response, ensure_ascii=False).encode('utf-8')
+            close = headers.get('connection', '').lower() == 'close'
+            writer.write(f'HTTP/1.1 {status} {REASONS[status]}\r\nContent-Type: application/json; charset=utf-8\r\nContent-Length: {len(data)}\r\n{"Connection: close" if close else "Connection: keep-alive"}\r\n\r\n'.encode('latin-1') + data)
+            await writer.drain()
+
+            if close:
+                break
+
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+
+    finally:
+        writer.close()
+
+async def respond(batcher, method, path, body):
+    if path == '/health':
+        health = {'status': 'ok', 'method': batcher.method, 'batches': batcher.batches, 'sentences': batcher.sentences}
+
+        # The cache is only in this process when the batches are decoded in a thread.
+
+        if batcher.cache_size and isinstance(batcher.executor, concurrent.futures.ThreadPoolExecutor):
+            health['cache'] = segmentation.load_cache(batcher.method, batcher.filename, batcher.cache_size, batcher.clauses, batcher.dictionary).stats()
+
+        return 200, health
+
+    if path != '/segment':
+        return 404, {'error': f'Unknown path {path}'}
+
+    if method != 'POST':
+        return 405, {'error': 'Use POST to segment'}
+
+    request = json.loads(body)
+    sentences = [request['text']] if 'text' in request else request['sentences']
+
+    if not isinstance(sentences, list) or not all(isinstance(sentence, str) for sentence in sentences):
+        raise TypeError('sentences must be a list of strings, and text must be a string')
+
+    if 'text' in request:
+        return 200, {'words': (await batcher.segment(sentences))[0]}
+
+    return 200, {'words': await batcher.segment(sentences)}
+
+async def serve(method='hmm', filename=None, host='127.0.0.1', port=8080, unix=None, workers=1, window=0.005, max_batch=256, cache_size=0, clauses=False, dictionary=None):
+    segmentation.load(method, filename, dictionary)
+
+    # The workers are started by a fork server, so that they do not inherit the sockets of the connections that are open when they start,
+    # which would keep those connections open after they are closed here.
+
+    if workers > 1:
+        executor = concurrent.futures.ProcessPoolExecutor(workers, multiprocessing.get_context('forkserver'), segmentation.load, (method, filename, dictionary))
+
+    else:
+        executor = concurrent.futures.ThreadPoolExecutor(1)
+
+    batcher = Batcher(method, filename, executor, window, max_batch, cache_size, clauses, workers, dictionary)
+    batching = asyncio.create_task(batcher.run())
+    handler = functools.partial(handle, batcher)
+
+    if unix:
+        server = await asyncio.start_unix_server(handler, unix)
+        print(f'Serving {method} on {unix}')
+
+    else:
+        server = await asyncio.start_server(handler, host, port)
+        print(f'Serving {method} on http://{host}:{port}')
+
+    try:
+        async with server:
+            await server.serve_forever()
+
+    finally:
+        batching.cancel()
+        executor.shutdown()
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description='Serve Vietnamese word segmentation over HTTP.')
+    parser.add_argument('-m', '--method', choices=segmentation.METHODS, default='hmm', help='the segmentation method (default: hmm)')
+    parser.add_argument('-f', '--filename', help='the model file, or the dictionary for maximal matching')
+    parser.add_argument('-d', '--dictionary', help='the dictionary for the hybrid methods (default: Viet74K.txt)')
+    parser.add_argument('--host', default='127.0.0.1', help='the host to listen on (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8080, help='the port to listen on (default: 8080)')
+    parser.add_argument('--unix', help='a Unix socket to listen on instead of a port')
+    parser.add_argument('-w', '--workers', type=int, default=1, help='the number of worker processes (default: 1, a thread)')
+    parser.add_argument('--window', type=float, default=5, help='how long to wait to fill a batch, in milliseconds (default: 5)')
+    parser.add_argument('--max-batch', type=int, default=256, help='the largest number of sentences in a batch (default: 256)')
+    parser.add_argument('--cache', type=int, default=0, metavar='SIZE', help='cache up to this many segmentations (default: 0, no cache)')
+    parser.add_argument('--clauses', action='store_true', help='cache clauses split at punctuation instead of whole sentences')
+    arguments = parser.parse_args(arguments)
+
+    try:
+        asyncio.run(serve(arguments.method, arguments.filename, arguments.host, arguments.port, arguments.unix, arguments.workers, arguments.window / 1000, arguments.max_batch, arguments.cache, arguments.clauses, arguments.dictionary))
+
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
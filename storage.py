@@ -0,0 +1,228 @@
+import bisect
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from vocabulary import Vocabulary, pair, unpair
+
+# This is the on-disk format for trained models.
+# A model file starts with a magic number, a version, and a JSON header,
+# followed by sections that are either flat arrays or vocabularies stored as newline-separated UTF-8.
+# The header gives the kind of model and, for each section, its typecode, offset, and length in bytes.
+# Sections are aligned to 8 bytes, so that loading can memory-map the file and use the arrays in place.
+# Several processes that load the same file then share the same physical pages.
+
+MAGIC = b'WSEG'
+VERSION = 4
+
+def save(filename, kind, sections):
+    header = {'kind': kind, 'version': VERSION, 'byteorder': sys.byteorder, 'sections': {}}
+    data = []
+    offset = 0
+
+    for name, section in sections.items():
+        if isinstance(section, Vocabulary):
+            typecode = 'vocabulary'
+            section = '\n'.join(section.tokens).encode('utf-8')
+
+        else:
+            typecode = section.typecode if isinstance(section, array) else section.format
+            section = section.tobytes()
+
+        header['sections'][name] = [typecode, offset, len(section)]
+        data.append(section)
+        data.append(bytes(-len(section) % 8))
+        offset += len(section) + -len(section) % 8
+
+    header = json.dumps(header).encode('utf-8')
+    header += b' ' * (-(len(MAGIC) + 4 + len(header)) % 8)
+
+    # The file is written to a temporary file first, so that a process loading the model never sees a partially written file.
+
+    temporary_filename = f'{filename}.{os.getpid()}'
+
+    with open(temporary_filename, 'wb') as file:
+        file.write(MAGIC)
+        file.write(struct.pack('<I', len(header)))
+        file.write(header)
+
+        for section in data:
+            file.write(section)
+
+    os.replace(temporary_filename, filename)
+
+def load(filename, kind):
+    with open(filename, 'rb') as file:
+        mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    view = memoryview(mapping)
+
+    if view[:len(MAGIC)] != MAGIC:
+        raise ValueError(f'{filename} is not a model file')
+
+    length, = struct.unpack('<I', view[len(MAGIC):len(MAGIC) + 4])
+    start = len(MAGIC) + 4 + length
+    header = json.loads(str(view[len(MAGIC) + 4:start], 'utf-8'))
+
+    if header['version'] != VERSION:
+        raise ValueError(f'{filename} has version {header["version"]}, but only version {VERSION} is supported')
+
+    if header['kind'] != kind:
+        raise ValueError(f'{filename} is a {header["kind"]} model, not a {kind} model')
+
+    if header['byteorder'] != sys.byteorder:
+        raise ValueError(f'{filename} was saved with a different byte order')
+
+    sections = {}
+
+    for name, (typecode, offset, length) in header['sections'].items():
+        section = view[start + offset:start + offset + length]
+
+        if typecode == 'vocabulary':
+            sections[name] = Vocabulary.from_tokens(str(section, 'utf-8').split('\n'))
+
+        else:
+            sections[name] = section.cast(typecode)
+
+    return sections
+
+# Here, we turn a memory-mapped section back into an array that can be modified.
+
+def thaw(section):
+    if isinstance(section, memoryview):
+        return array(section.format, section.tobytes())
+
+    return section
+
+# Here, we copy an array so that it is not changed by further training. Memory-mapped sections are read-only, so they are kept as they are.
+
+def snapshot(section):
+    if isinstance(section, memoryview):
+        return section
+
+    return array(section.typecode, section)
+
+# This is a read-only table from packed pairs of IDs to values, stored as a sorted array of keys and a parallel array of values.
+# It supports the parts of the dict interface that decoding uses, with lookups by binary search.
+
+class FrozenTable:
+    def __init__(self, keys, values):
+        self.sorted_keys = keys
+        self.sorted_values = values
+
+    @classmethod
+    def from_dict(cls, table):
+        if isinstance(table, FrozenTable):
+            return table
+
+        keys = array('Q', sorted(table))
+        return cls(keys, array('d', (table[key] for key in keys)))
+
+    def __len__(self):
+        return len(self.sorted_keys)
+
+    def __contains__(self, key):
+        i = bisect.bisect_left(self.sorted_keys, key)
+        return i < len(self.sorted_keys) and self.sorted_keys[i] == key
+
+    def get(self, key, default=None):
+        i = bisect.bisect_left(self.sorted_keys, key)
+
+        if i < len(self.sorted_keys) and self.sorted_keys[i] == key:
+            return self.sorted_values[i]
+
+        return default
+
+    def values(self):
+        return self.sorted_values
+
+    def items(self):
+        return zip(self.sorted_keys, self.sorted_values)
+
+# This is a more compact read-only table from pairs of IDs to counts, for when the first IDs are dense, like syllable IDs.
+# The pairs are grouped by their first ID, like a sparse matrix in compressed sparse row form:
+# offsets[first] to offsets[first + 1] is the range of seconds and counts for the pairs that start with first,
+# with the seconds sorted, so that each pair takes 4 bytes for its second ID and 4 for its count, instead of 16 in a FrozenTable,
+# and a lookup is a binary search of only the pairs that start with the same ID.
+
+class PairTable:
+    def __init__(self, offsets, seconds, counts):
+        self.offsets = offsets
+        self.seconds = seconds
+        self.counts = counts
+
+    # Here, we freeze a dict from packed pairs to counts, where every first ID is less than size.
+
+    @classmethod
+    def from_dict(cls, table, size):
+        if isinstance(table, PairTable):
+            return table
+
+        offsets = array('I', [0] * (size + 1))
+        seconds = array('I')
+        counts = array('I')
+
+        for key in sorted(table):
+            first, second = unpair(key)
+            offsets[first + 1] += 1
+            seconds.append(second)
+            counts.append(table[key])
+
+        for first in range(size):
+            offsets[first + 1] += offsets[first]
+
+        return cls(offsets, seconds, counts)
+
+    def __len__(self):
+        return len(self.seconds)
+
+    def find(self, first, second):
+        if first + 1 >= len(self.offsets):
+            return -1
+
+        start = self.offsets[first]
+        end = self.offsets[first + 1]
+        i = bisect.bisect_left(self.seconds, second, start, end)
+        return i if i < end and self.seconds[i] == second else -1
+
+    def __contains__(self, key):
+        return self.find(*unpair(key)) >= 0
+
+    def get(self, key, default=None):
+        i = self.find(*unpair(key))
+        return self.counts[i] if i >= 0 else default
+
+    # Here, we look up the counts of every pair of neighbouring IDs at once, such as for all the boundaries of a sentence,
+    # with 0 for pairs that are not in the table.
+
+    def lookup(self, ids):
+        offsets = self.offsets
+        seconds = self.seconds
+        counts = self.counts
+        size = len(offsets) - 1
+        results = [0] * max(len(ids) - 1, 0)
+
+        for i in range(len(ids) - 1):
+            first = ids[i]
+
+            if first < size:
+                start = offsets[first]
+                end = offsets[first + 1]
+
+                if start < end:
+                    j = bisect.bisect_left(seconds, ids[i + 1], start, end)
+
+                    if j < end and seconds[j] == ids[i + 1]:
+                        results[i] = counts[j]
+
+        return results
+
+    def values(self):
+        return self.counts
+
+    def items(self):
+        for first in range(len(self.offsets) - 1):
+            for i in range(self.offsets[first], self.offsets[first + 1]):
+                yield pair(first, self.seconds[i]), self.counts[i]
@@ -0,0 +1,353 @@
+import itertools
+import math
+import os
+import random
+import tempfile
+import unittest
+from array import array
+import graphs
+import hmm
+import storage
+import transitional_frequencies
+import trigram_hmm
+from chunking import crossings
+from corpus import join_words
+from evaluation import Evaluation
+from trie import build_lattice, build_trie, greedy_match
+from vocabulary import pair, unpair
+
+# These check that the fast paths of the models agree with the slow ways of getting the same results,
+# such as the one-pass threshold sweep with decoding at every threshold, the n-best decoders with scoring every segmentation,
+# the trie and PairTable with a dict, and update() with training on everything at once.
+# The sentences are made up from a few words, so the tests do not need the corpora. Run them with python -m unittest test_models.
+
+WORDS = ['xin chào', 'các', 'bạn', 'việt nam', 'học sinh', 'máy tính', 'năm', 'mới', 'người', 'nhà', 'tính', 'học', 'sinh viên', 'chào']
+
+def make_sentences(count, seed=0):
+    generator = random.Random(seed)
+    sentences = []
+
+    for _ in range(count):
+        words = [generator.choice(WORDS) for _ in range(generator.randint(1, 8))]
+        syllables = ' '.join(words).split()
+        boundaries = []
+
+        for word in words:
+            boundaries.extend([0] * (len(word.split()) - 1) + [1])
+
+        sentences.append((syllables, boundaries[:-1]))
+
+    return sentences
+
+# Here, we write sentences as an EVBCorpus SGML file, aligning each word to its own English word.
+
+def write_sgml(filename, sentences):
+    with open(filename, 'w') as file:
+        for n, (syllables, boundaries) in enumerate(sentences, 1):
+            alignments = []
+            start = 0
+
+            for i, boundary in enumerate(boundaries + [1]):
+                if boundary:
+                    alignments.append(f'{len(alignments) + 1}-{",".join(str(j + 1) for j in range(start, i + 1))}')
+                    start = i + 1
+
+            file.write(f'<spair id="{n}">\n<s id="en{n}">x</s>\n<s id="vn{n}">{" ".join(syllables)}</s>\n<a>{";".join(alignments)};</a>\n</spair>\n')
+
+class TestSweep(unittest.TestCase):
+    def test_sweep_matches_decode(self):
+        model = transitional_frequencies.TransitionalModel()
+
+        for syllables, boundaries in make_sentences(200):
+            model.train(syllables)
+
+        sentences = make_sentences(50, seed=1)
+        loners = {'năm', 'người'}
+        scores, labels, loner_flags = transitional_frequencies.score(model, sentences, loners)
+
+        # The thresholds include every score, where a boundary is only just not posited.
+
+        thresholds = [0] + sorted(set(scores)) + [1000001]
+        results = transitional_frequencies.sweep(scores, labels, loner_flags, thresholds)
+
+        for threshold, result in zip(thresholds, results):
+            evaluation = Evaluation()
+
+            for syllables, boundaries in sentences:
+                evaluation.add(boundaries, model.decode(syllables, threshold, loners))
+
+            self.assertEqual(result, evaluation.metrics())
+
+# Here, we score every segmentation of some syllables that is a path through the bigram model's lattice,
+# which is one where every word is known or a single syllable, best first.
+
+def bigram_segmentations(model, syllables):
+    scorer = model.scorer()
+    segmentations = []
+
+    for boundaries in itertools.product(range(2), repeat=len(syllables) - 1):
+        words = join_words(syllables, list(boundaries))
+        ids = [model.vocabulary.get(word) for word in words]
+
+        if all(id or ' ' not in word for id, word in zip(ids, words)):
+            segmentations.append((sum(scorer.log_probability(previous, id) for previous, id in zip([model.bos] + ids, ids)), list(boundaries)))
+
+    return sorted(segmentations, key=lambda segmentation: segmentation[0], reverse=True)
+
+# Here, we score every BI-tag sequence of some syllables under an HMM, keeping the best of each segmentation and leaving out the impossible ones,
+# best first. Syllables that were never seen get a log emission of 0, like in decode_nbest.
+
+def hmm_segmentations(model, syllables):
+    observations = model.vocabulary.encode(syllables)
+    log_B = [[model.log_B[2 * o + s] if o else 0.0 for s in range(2)] for o in observations]
+    segmentations = {}
+
+    for bi_tags in itertools.product(range(2), repeat=len(syllables)):
+        score = model.log_π[bi_tags[0]] + log_B[0][bi_tags[0]]
+
+        for t in range(1, len(syllables)):
+            score += model.log_A[2 * bi_tags[t - 1] + bi_tags[t]] + log_B[t][bi_tags[t]]
+
+        if score > -math.inf:
+            segmentations[bi_tags[1:]] = max(score, segmentations.get(bi_tags[1:], -math.inf))
+
+    return sorted(((score, [1 - bi_tag for bi_tag in bi_tags]) for bi_tags, score in segmentations.items()), key=lambda segmentation: segmentation[0], reverse=True)
+
+def assert_scores_equal(test, scores, expected):
+    test.assertEqual(len(scores), len(expected))
+
+    for score, expected_score in zip(scores, expected):
+        test.assertTrue(score == expected_score or math.isclose(score, expected_score, rel_tol=1e-9), (score, expected_score))
+
+class TestNBest(unittest.TestCase):
+    def check_hmm(self, model, syllables, k):
+        segmentations = hmm_segmentations(model, syllables)
+        nbest = model.decode_nbest(syllables, k)
+        assert_scores_equal(self, [score for score, bi_tags in nbest], [score for score, boundaries in segmentations[:k]])
+        self.assertEqual(len({tuple(bi_tags[1:]) for score, bi_tags in nbest}), len(nbest))
+        return nbest
+
+    def test_hmm(self):
+        model = hmm.HMM()
+
+        for syllables, boundaries in make_sentences(200):
+            model.train(syllables, boundaries)
+
+        model.estimate()
+
+        for syllables, boundaries in make_sentences(20, seed=2):
+            nbest = self.check_hmm(model, syllables[:7], 5)
+            self.assertEqual(nbest[0][1], model.decode(syllables[:7]))
+
+        # Unseen syllables, and a model where both states can start a sentence, give no impossible or repeated segmentations.
+
+        self.assertEqual(model.decode_nbest(['zzz'], 3), [(0.0, ['B'])])
+        self.check_hmm(model, ['zzz', 'học', 'yyy', 'sinh'], 5)
+        model.π = array('d', [0.75, 0.25])
+        model.log_π = array('d', map(math.log, model.π))
+
+        for syllables, boundaries in make_sentences(20, seed=2):
+            self.check_hmm(model, syllables[:7], 5)
+
+    def check_graphs(self, model, syllables, k):
+        segmentations = bigram_segmentations(model, syllables)
+        nbest = model.decode_nbest(syllables, k)
+        assert_scores_equal(self, [score for score, boundaries in nbest], [score for score, boundaries in segmentations[:k]])
+        self.assertEqual(nbest[0][1], model.decode(syllables))
+        self.assertIn(model.decode(syllables), [boundaries for score, boundaries in segmentations if math.isclose(score, segmentations[0][0], rel_tol=1e-9)])
+
+    def test_graphs(self):
+        model = graphs.BigramModel()
+
+        for syllables, boundaries in make_sentences(200):
+            model.train(join_words(syllables, boundaries))
+
+        for syllables, boundaries in make_sentences(20, seed=3):
+            self.check_graphs(model, syllables[:8], 5)
+
+    # The best path into a vertex is not always the start of the best path through it, since the next word depends on the last one,
+    # which these small models with overlapping words bring out.
+
+    def test_graphs_overlapping_words(self):
+        words = ['a', 'b', 'c', 'a b', 'b c', 'c a', 'a b c', 'd', 'd a']
+
+        for seed in range(200):
+            generator = random.Random(seed)
+            model = graphs.BigramModel()
+
+            for _ in range(generator.randint(3, 15)):
+                model.train([generator.choice(words) for _ in range(generator.randint(1, 6))])
+
+            self.check_graphs(model, [generator.choice('abcd') for _ in range(generator.randint(1, 7))], 3)
+
+# Here, the words found by walking the trie should be the ones found by looking up every span of syllables in a dict.
+
+class TestTrie(unittest.TestCase):
+    def test_matches_dict(self):
+        words = WORDS + ['học sinh viên', 'việt', 'nam học', 'chào các bạn', '']
+        trie = build_trie(words)
+        indices = {word: i for i, word in enumerate(words) if word}
+
+        for syllables, boundaries in make_sentences(100, seed=7):
+            syllables = syllables + ['zzz'] + syllables[:3]
+            offsets, ends, ids = build_lattice(trie, syllables, -1)
+            costs = crossings(trie, 4)(syllables, 0, len(syllables) - 1)
+
+            for i in range(len(syllables)):
+                expected = [(i + 1, indices.get(syllables[i], -1))] + [(j, indices[' '.join(syllables[i:j])]) for j in range(i + 2, len(syllables) + 1) if ' '.join(syllables[i:j]) in indices]
+                self.assertEqual([(ends[k], ids[k]) for k in range(offsets[i], offsets[i + 1])], expected)
+
+                end = i + 1
+
+                while end < len(syllables) and ' '.join(syllables[i:end + 1]) in indices:
+                    end += 1
+
+                self.assertEqual(greedy_match(trie, syllables, i), end)
+
+            spans = [(i, j) for i in range(len(syllables)) for j in range(i + 2, min(i + 4, len(syllables)) + 1) if ' '.join(syllables[i:j]) in indices]
+
+            for p in range(1, len(syllables)):
+                self.assertEqual(costs[p], sum(1 for i, j in spans if i < p < j))
+
+class TestPairTable(unittest.TestCase):
+    def test_matches_dict(self):
+        generator = random.Random(4)
+        table = {pair(generator.randrange(1, 50), generator.randrange(1, 50)): generator.randrange(1, 1000) for _ in range(500)}
+
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'table.model')
+            frozen = storage.PairTable.from_dict(table, 50)
+            storage.save(filename, 'table', {'offsets': frozen.offsets, 'seconds': frozen.seconds, 'counts': frozen.counts})
+            sections = storage.load(filename, 'table')
+
+            for frozen in (frozen, storage.PairTable(sections['offsets'], sections['seconds'], sections['counts'])):
+                self.assertEqual(len(frozen), len(table))
+                self.assertEqual(dict(frozen.items()), table)
+
+                for first in range(52):
+                    for second in range(52):
+                        key = pair(first, second)
+                        self.assertEqual(frozen.get(key, 0), table.get(key, 0))
+                        self.assertEqual(key in frozen, key in table)
+
+                ids = [generator.randrange(0, 52) for _ in range(300)]
+                self.assertEqual(frozen.lookup(ids), [table.get(pair(first, second), 0) for first, second in zip(ids, ids[1:])])
+
+# Here, a model trained on some sentences, saved, loaded, and updated with the rest should be the same as one trained on all of them.
+
+class TestUpdate(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.first = make_sentences(100, seed=5)
+        self.second = make_sentences(100, seed=6) + [(['từ', 'mới'], [0])]
+        self.filename = os.path.join(self.directory.name, 'second.sgml')
+        self.model_filename = os.path.join(self.directory.name, 'first.model')
+        write_sgml(self.filename, self.second)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_hmm(self):
+        model = hmm.HMM()
+        full_model = hmm.HMM()
+
+        for syllables, boundaries in self.first:
+            model.train(syllables, boundaries)
+            full_model.train(syllables, boundaries)
+
+        for syllables, boundaries in self.second:
+            full_model.train(syllables, boundaries)
+
+        model.estimate()
+        model.save(self.model_filename)
+        model = hmm.HMM.load(self.model_filename)
+        model.update([self.filename])
+        full_model.estimate()
+
+        self.assertEqual(model.vocabulary.tokens, full_model.vocabulary.tokens)
+
+        for name in ('A_counts', 'B_counts', 'log_A', 'log_B'):
+            self.assertEqual(list(getattr(model, name)), list(getattr(full_model, name)))
+
+    def test_trigram_hmm(self):
+        model = trigram_hmm.TrigramHMM()
+        full_model = trigram_hmm.TrigramHMM()
+
+        for syllables, boundaries in self.first:
+            model.train(syllables, boundaries)
+            full_model.train(syllables, boundaries)
+
+        for syllables, boundaries in self.second:
+            full_model.train(syllables, boundaries)
+
+        model.estimate()
+        model.save(self.model_filename)
+        model = trigram_hmm.TrigramHMM.load(self.model_filename)
+        model.update([self.filename])
+        full_model.estimate()
+
+        for name in ('unigram_counts', 'bigram_counts', 'trigram_counts', 'B_counts', 'λ', 'log_A', 'log_B'):
+            self.assertEqual(list(getattr(model, name)), list(getattr(full_model, name)))
+
+        for syllables, boundaries in self.second:
+            self.assertEqual(model.decode(syllables), full_model.decode(syllables))
+
+    def test_graphs(self):
+        model = graphs.BigramModel()
+        full_model = graphs.BigramModel()
+
+        for syllables, boundaries in self.first:
+            model.train(join_words(syllables, boundaries))
+            full_model.train(join_words(syllables, boundaries))
+
+        for syllables, boundaries in self.second:
+            full_model.train(join_words(syllables, boundaries))
+
+        model.save(self.model_filename)
+        model = graphs.BigramModel.load(self.model_filename)
+        model.update([self.filename])
+
+        self.assertEqual(model.vocabulary.tokens, full_model.vocabulary.tokens)
+        self.assertEqual(dict(model.bigram_counts), full_model.bigram_counts)
+
+        for name in ('unigram_counts', 'history_counts', 'follower_counts', 'totals'):
+            self.assertEqual(list(getattr(model, name)), list(getattr(full_model, name)))
+
+        for syllables, boundaries in self.second:
+            self.assertEqual(model.decode(syllables), full_model.decode(syllables))
+
+    def test_transitional_frequencies(self):
+        filename = os.path.join(self.directory.name, 'second.txt')
+
+        with open(filename, 'w') as file:
+            for syllables, boundaries in self.second:
+                file.write(' '.join(syllables) + '\n')
+
+        model = transitional_frequencies.TransitionalModel()
+        full_model = transitional_frequencies.TransitionalModel()
+
+        for syllables, boundaries in self.first:
+            model.train(syllables)
+            full_model.train(syllables)
+
+        for syllables, boundaries in self.second:
+            full_model.train(syllables)
+
+        model.save(self.model_filename)
+        model = transitional_frequencies.TransitionalModel.load(self.model_filename)
+        model.update([filename])
+
+        # The syllables of the update can be added to the vocabulary in a different order, so the counts are compared by syllable.
+
+        def counts(model):
+            return {(model.vocabulary[first], model.vocabulary[second]): count for first, second, count in ((*unpair(key), count) for key, count in model.transitional_counts.items())}
+
+        self.assertEqual(counts(model), counts(full_model))
+        self.assertEqual({token: model.frequencies[id] for id, token in enumerate(model.vocabulary.tokens)}, {token: full_model.frequencies[id] for id, token in enumerate(full_model.vocabulary.tokens)})
+        self.assertEqual(list(model.totals), list(full_model.totals))
+
+        for syllables, boundaries in self.second:
+            self.assertEqual(model.decode(syllables), full_model.decode(syllables))
+
+if __name__ == '__main__':
+    unittest.main()
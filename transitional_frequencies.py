@@ -1,180 +1,349 @@
+import bisect
 import collections
-import pickle
+import math
+import multiprocessing
 import os
-import re
-import unicodedata
+from array import array
+import storage
+from corpus import read_corpus, read_sgml
+from dataset import Dataset
+from evaluation import Evaluation, metrics
+from instrumentation import progress, timed
+from normalization import normalize
+from vocabulary import Vocabulary, pair
 
-# First, we will train.
+# These are common syllables that are always taken to be words by themselves.
 
-def normalize(string):
-    alphabet = 'aàảãáạăằẳẵắặâầẩẫấậbcdđeèẻẽéẹêềểễếệfghiìỉĩíịjklmnoòỏõóọôồổỗốộơờởỡớợpqrstuùủũúụưừửữứựvwxyỳỷỹýỵz'
-    return re.sub(f'[^{alphabet} ]', '', unicodedata.normalize('NFC', string).lower())
+loners = {'và', 'của', 'có', 'là', 'trong', 'các', 'với', 'được', 'cho', 'không', 'đã', 'người', 'một', 'công', 'để', 'năm', 'khi', 'những', 'này', 'đến', 'ở', 'đó', 'từ', 'tại', 'nhiều', 'cũng', 'sẽ', 'về', 'vào', 'ra', 'nhà', 'trên'}
 
-training_filename = 'vie_news_2022_1M/vie_news_2022_1M-sentences.txt'
-cache_filename = 'transitional_frequencies.pickle'
+# Syllables are given IDs by the vocabulary, so syllable frequencies are a flat array indexed by syllable ID,
+# and transitional frequencies are keyed by the packed pair of syllable IDs instead of a tuple of strings.
+# Only the raw counts and the total number of transitions are kept, and transitional frequencies are worked out from them when they are needed,
+# so that more data can be added to a trained model at any time.
+# For decoding, the counts are frozen into a storage.PairTable, which takes about a quarter of the memory of the dict,
+# and looks up every boundary of a sentence in one call.
 
-if cache_filename not in os.listdir():
-    with open(training_filename, 'r') as file:
-        n = sum(1 for line in file)
+class TransitionalModel:
+    def __init__(self):
+        self.vocabulary = Vocabulary()
+        self.frequencies = array('d', [0])
+        self.transitional_counts = {}
+        self.totals = array('d', [0])
+        self.threshold = 1
+        self.frozen = None
 
-    with open(training_filename, 'r') as file:
-        frequencies = collections.defaultdict(int)
-        transitional_frequencies = collections.defaultdict(int)
+    def add(self, syllable):
+        id = self.vocabulary.add(syllable)
 
-        for i, line in enumerate(file):
-            print(f'Counting transitional frequencies... {i / n : 5.2%}')
-            syllables = normalize(line).split()
+        if id == len(self.frequencies):
+            self.frequencies.append(0)
 
-            for syllable in syllables:
-                frequencies[syllable] += 1
+        return id
 
-            for i in range(len(syllables) - 1):
-                transitional_frequencies[(syllables[i], syllables[i + 1])] += 1
+    def train(self, syllables):
+        self.train_ids([self.add(syllable) for syllable in syllables])
 
-    n = len(transitional_frequencies.values())
-    s = sum(transitional_frequencies.values())
+    def train_ids(self, ids):
+        for id in ids:
+            self.frequencies[id] += 1
 
-    for i, (key, value) in enumerate(transitional_frequencies.items()):
-        print(f'Normalizing transitional frequencies... {i / n : 5.2%}')
-        transitional_frequencies[key] = 1000000 * value / s
+        for i in range(len(ids) - 1):
+            key = pair(ids[i], ids[i + 1])
+            self.transitional_counts[key] = self.transitional_counts.get(key, 0) + 1
 
-    with open(cache_filename, 'wb') as file:
-            pickle.dump((frequencies, transitional_frequencies), file)
+        self.totals[0] += max(len(ids) - 1, 0)
+        self.frozen = None
 
-with open(cache_filename, 'rb') as file:
-    frequencies, transitional_frequencies = pickle.load(file)
+    # Here, we add frequencies that were counted elsewhere, as Counters keyed by syllables and by pairs of syllables.
 
-# Now, we will test.
+    def train_counts(self, frequencies, transitional_frequencies):
+        for syllable, frequency in frequencies.items():
+            self.frequencies[self.add(syllable)] += frequency
 
-os.chdir('EVBCorpus_EVBNews_v2.0')
+        for (first, second), frequency in transitional_frequencies.items():
+            key = pair(self.add(first), self.add(second))
+            self.transitional_counts[key] = self.transitional_counts.get(key, 0) + frequency
+            self.totals[0] += frequency
 
-def test(filenames, threshold, loners, verbose=False):
-    true_positives = 0
-    false_positives = 0
-    true_negatives = 0
-    false_negatives = 0
+        self.frozen = None
 
-    for i, filename in enumerate(filenames):
-        print(f'Testing... {i / len(filenames) : 5.2%}')
+    # Here, we add the sentences of a dataset.Dataset, mapping its syllable IDs to the model's once, instead of normalizing any text.
 
-        with open(filename, 'r') as file:
-            for line in file:
-                if not line.startswith("<spair"):
-                    continue
+    def train_dataset(self, dataset):
+        ids = [self.add(syllable) for syllable in dataset.vocabulary.tokens]
 
-                if verbose:
-                    print(re.findall(r'\d+', line)[0])
+        for i in range(len(dataset)):
+            progress(f'Counting transitional frequencies... {i / len(dataset) : 5.2%}')
+            self.train_ids([ids[id] for id in dataset.sentence_ids(i)])
 
-                next(file)
-                syllables = normalize(re.sub(r'<.*?>|</s>', '', next(file))).split()
+    # Here, we add more files of raw sentences to a trained model.
 
-                # Here, we will get the actual word boundaries from the test data.
+    def update(self, filenames):
+        self.frequencies = storage.thaw(self.frequencies)
+        self.totals = storage.thaw(self.totals)
 
-                try:
-                    actual_boundaries = [1 for _ in range(len(syllables) - 1)]
-                    annotations = re.sub(r'<.*?>|;</a>\n', '', next(file)).split(';')
+        if isinstance(self.transitional_counts, storage.PairTable):
+            self.transitional_counts = dict(self.transitional_counts.items())
 
-                    for annotation in annotations:
-                        syllable_indices = [int(_) - 1 for _ in annotation.split('-')[1].split(',')]
+        for filename in filenames:
+            self.train_counts(*count_shard((filename, 0, os.path.getsize(filename))))
 
-                        for i, j in zip(syllable_indices[:-1], syllable_indices[1:]):
-                            if i + 1 == j:
-                                actual_boundaries[i] = 0
+    # Here, we get the frozen transitional counts for the model as it is now, which are kept until the model is trained further.
 
-                except IndexError:
-                    continue
+    def table(self):
+        if self.frozen is None:
+            self.frozen = storage.PairTable.from_dict(self.transitional_counts, len(self.vocabulary))
 
-                except ValueError:
-                    continue
+        return self.frozen
 
-                # Here, we will posit word boundaries using transitional frequencies.
+    # Here, we will posit word boundaries using transitional frequencies,
+    # which are the occurrences of a transition per million transitions.
+    # A model without any transitions gives every transition a frequency of 0.
+    # The threshold defaults to the one that was tuned for the model.
 
-                posited_boundaries = [0 for _ in range(len(syllables) - 1)]
+    @timed('decoding')
+    def decode(self, syllables, threshold=None, loners=loners):
+        if threshold is None:
+            threshold = self.threshold
 
-                for i in range(len(syllables) - 1):
-                    if transitional_frequencies[(syllables[i], syllables[i + 1])] < threshold or syllables[i] in loners or syllables[i + 1] in loners:
-                        posited_boundaries[i] = 1
+        total = self.totals[0] or math.inf
+        counts = self.table().lookup(self.vocabulary.encode(syllables))
+        posited_boundaries = [0 for _ in range(len(syllables) - 1)]
 
-                # Here, we will count true/false positives/negatives.
+        for i, count in enumerate(counts):
+            if 1000000 * count / total < threshold or syllables[i] in loners or syllables[i + 1] in loners:
+                posited_boundaries[i] = 1
 
-                for i in range(len(syllables) - 1):
-                    if actual_boundaries[i] == posited_boundaries[i]:
-                        if posited_boundaries[i] == 1:
-                            true_positives += 1
+        return posited_boundaries
 
-                        else:
-                            true_negatives += 1
+    # Here, we save the trained model, or load it with the arrays memory-mapped from the file.
+    # The transitional counts are saved as the arrays of their PairTable, which a loaded model looks up in place.
+    # A loaded model is read-only until it is updated, which copies the arrays into memory.
 
-                    else:
-                        if posited_boundaries[i] == 1:
-                            false_positives += 1
+    def save(self, filename):
+        transitional_counts = self.table()
 
-                        else:
-                            false_negatives += 1
+        storage.save(filename, 'transitional', {
+            'vocabulary': self.vocabulary,
+            'frequencies': self.frequencies,
+            'transitional_offsets': transitional_counts.offsets,
+            'transitional_seconds': transitional_counts.seconds,
+            'transitional_counts': transitional_counts.counts,
+            'totals': self.totals,
+            'threshold': array('d', [self.threshold])
+        })
 
-                # Here, we will print out the sentence with the word boundaries visualized.
+    @classmethod
+    def load(cls, filename):
+        sections = storage.load(filename, 'transitional')
+        model = cls()
+        model.vocabulary = sections['vocabulary']
+        model.frequencies = sections['frequencies']
+        model.transitional_counts = storage.PairTable(sections['transitional_offsets'], sections['transitional_seconds'], sections['transitional_counts'])
+        model.totals = sections['totals']
+        model.threshold = sections['threshold'][0]
+        return model
+
+# Here, we train on a large file of raw sentences in parallel.
+# The file is split into byte ranges, and each process counts the lines that start in its range.
+# The partial counts are merged pairwise by the processes as well, so the merging is a tree reduction,
+# and only the last merge happens in this process.
 
-                if verbose:
-                    for i, syllable in enumerate(syllables):
-                        print(syllable, end=' ')
+def count_shard(shard):
+    filename, start, end = shard
+    frequencies = collections.Counter()
+    transitional_frequencies = collections.Counter()
 
-                        if i < len(syllables) - 1:
-                            print(end='| ' if actual_boundaries[i] else '')
+    with open(filename, 'rb') as file:
+        # If the range starts in the middle of a line, that line belongs to the previous range.
+
+        if start > 0:
+            file.seek(start - 1)
+            file.readline()
 
+        while file.tell() < end:
+            line = file.readline()
 
-                    print()
+            if not line:
+                break
 
-                    for i, syllable in enumerate(syllables):
-                        print(syllable, end=' ')
+            syllables = normalize(line.decode('utf-8')).split()
+            frequencies.update(syllables)
+            transitional_frequencies.update(zip(syllables[:-1], syllables[1:]))
 
-                        if i < len(syllables) - 1:
-                            print(end='| ' if posited_boundaries[i] else '')
+    return frequencies, transitional_frequencies
 
-                    print('\n')
+def merge_counts(first, second):
+    first[0].update(second[0])
+    first[1].update(second[1])
+    return first
 
-    # Here, we will calculate the accuracy, precision, recall, and F1.
+def train_parallel(filename, processes=None, shards=None):
+    processes = processes or os.cpu_count()
+    shards = shards or 16 * processes
+    size = os.path.getsize(filename)
+    counts = []
 
-    accuracy = (true_positives + true_negatives) / (true_positives + true_negatives + false_positives + false_negatives)
-    precision = true_positives / (true_positives + false_positives)
-    recall = true_positives / (true_positives + false_negatives)
-    f1 = (2 * precision * recall) / (precision + recall)
-    return accuracy, precision, recall, f1
+    with multiprocessing.Pool(processes) as pool:
+        for partial_counts in pool.imap_unordered(count_shard, [(filename, size * i // shards, size * (i + 1) // shards) for i in range(shards)]):
+            counts.append(partial_counts)
+            progress(f'Counting transitional frequencies... {len(counts) / shards : 5.2%}', final=len(counts) == shards)
+
+        while len(counts) > 1:
+            print(f'Merging transitional frequencies... {len(counts)} left')
+            merged = pool.starmap(merge_counts, zip(counts[0::2], counts[1::2]))
+
+            if len(counts) % 2:
+                merged.append(counts[-1])
+
+            counts = merged
+
+    model = TransitionalModel()
+    model.train_counts(*counts[0])
+    return model
+
+# Here, we tune the threshold without decoding the sentences once per threshold.
+# Every boundary in the sentences is scored once, recording its transitional frequency, whether it is an actual boundary, and whether it is next to a loner.
+# A boundary is posited if its transitional frequency is below the threshold or it is next to a loner,
+# so for the boundaries that are not next to loners, the positives for a threshold are a prefix of the boundaries sorted by transitional frequency,
+# and a cumulative sum of actual boundaries over that order gives the true positives for every threshold at once.
+
+def score(model, sentences, loners):
+    table = model.table()
+    total = model.totals[0] or math.inf
+    scores = array('d')
+    labels = bytearray()
+    loner_flags = bytearray()
+
+    for syllables, actual_boundaries in sentences:
+        counts = table.lookup(model.vocabulary.encode(syllables))
+
+        for i, count in enumerate(counts):
+            scores.append(1000000 * count / total)
+            labels.append(actual_boundaries[i])
+            loner_flags.append(syllables[i] in loners or syllables[i + 1] in loners)
+
+    return scores, labels, loner_flags
+
+def sweep(scores, labels, loner_flags, thresholds):
+    loner_positives = sum(label for label, loner in zip(labels, loner_flags) if loner)
+    loner_negatives = sum(loner_flags) - loner_positives
+    order = sorted((score, label) for score, label, loner in zip(scores, labels, loner_flags) if not loner)
+    sorted_scores = [score for score, label in order]
+    cumulative_labels = [0]
 
-# Here, we will learn the threshold parameter.
+    for score, label in order:
+        cumulative_labels.append(cumulative_labels[-1] + label)
 
-best_f1 = 0
-best_threshold = 1
-loners = set()
-loners = {'và', 'của', 'có', 'là', 'trong', 'các', 'với', 'được', 'cho', 'không', 'đã', 'người', 'một', 'công', 'để', 'năm', 'khi', 'những', 'này', 'đến', 'ở', 'đó', 'từ', 'tại', 'nhiều', 'cũng', 'sẽ', 'về', 'vào', 'ra', 'nhà', 'trên'}
+    results = []
+
+    for threshold in thresholds:
+        k = bisect.bisect_left(sorted_scores, threshold)
+        true_positives = loner_positives + cumulative_labels[k]
+        false_positives = loner_negatives + k - cumulative_labels[k]
+        false_negatives = cumulative_labels[-1] - cumulative_labels[k]
+        true_negatives = len(order) - k - false_negatives
+        results.append(metrics(true_positives, false_positives, true_negatives, false_negatives))
+
+    return results
+
+# Here, we pick the threshold with the best F1 on some sentences, taking the smallest threshold if there is a tie.
+
+def tune(model, sentences, loners, thresholds=range(1, 1000)):
+    best_f1 = 0
+    best_threshold = 1
+
+    for threshold, (accuracy, precision, recall, f1) in zip(thresholds, sweep(*score(model, sentences, loners), thresholds)):
+        if f1 > best_f1:
+            best_f1 = f1
+            best_threshold = threshold
+
+    return best_threshold
+
+# Here, we will test the model on some files.
+
+def test(model, filenames, threshold, loners, verbose=False):
+    evaluation = Evaluation()
+
+    for i, filename in enumerate(filenames):
+        progress(f'Testing... {i / len(filenames) : 5.2%}')
+
+        for syllables, actual_boundaries in read_sgml(filename, cache=True):
+            posited_boundaries = model.decode(syllables, threshold, loners)
+
+            evaluation.add(actual_boundaries, posited_boundaries, filename, len(syllables))
+
+            # Here, we will print out the sentence with the word boundaries visualized.
+
+            if verbose:
+                for i, syllable in enumerate(syllables):
+                    print(syllable, end=' ')
+
+                    if i < len(syllables) - 1:
+                        print(end='| ' if actual_boundaries[i] else '')
+
+
+                print()
+
+                for i, syllable in enumerate(syllables):
+                    print(syllable, end=' ')
+
+                    if i < len(syllables) - 1:
+                        print(end='| ' if posited_boundaries[i] else '')
+
+                print('\n')
+
+    return evaluation
+
+if __name__ == '__main__':
+    # First, we will train.
+
+    # If the news corpus was preprocessed with dataset.py, we will train on the dataset instead of the raw sentences.
+
+    training_filename = 'vie_news_2022_1M/vie_news_2022_1M-sentences.txt'
+    dataset_filename = 'vie_news_2022_1M/vie_news_2022_1M-sentences.dataset'
+    model_filename = os.path.abspath('transitional_frequencies.model')
+
+    if not os.path.exists(model_filename):
+        if os.path.exists(dataset_filename):
+            model = TransitionalModel()
+            model.train_dataset(Dataset.load(dataset_filename))
+
+        else:
+            model = train_parallel(training_filename)
+
+        model.save(model_filename)
+
+    model = TransitionalModel.load(model_filename)
+
+    # Now, we will test.
+
+    os.chdir('EVBCorpus_EVBNews_v2.0')
+
+    # Here, we will learn the threshold parameter.
+
+    withheld = {
+        'N0001.sgml',
+        'N0002.sgml',
+        'N0003.sgml',
+        'N0004.sgml',
+        'N0005.sgml',
+        'N0006.sgml',
+        'N0007.sgml',
+        'N0008.sgml',
+        'N0009.sgml',
+        'N0010.sgml'
+    }
+
+    print('Trying out some parameters...')
+    best_threshold = tune(model, read_corpus(sorted(withheld), cache=True), loners)
+    model.threshold = best_threshold
+    model.save(model_filename)
+
+    # Here, we will actually test.
+
+    evaluation = test(model, sorted({filename for filename in os.listdir() if filename.endswith('.sgml')} - withheld), best_threshold, loners)
+    print('Threshold:', best_threshold)
+    evaluation.print()
 
-withheld = {
-    'N0001.sgml',
-    'N0002.sgml',
-    'N0003.sgml',
-    'N0004.sgml',
-    'N0005.sgml',
-    'N0006.sgml',
-    'N0007.sgml',
-    'N0008.sgml',
-    'N0009.sgml',
-    'N0010.sgml'
-}
-
-for threshold in range(1, 1000):
-    print(f'Trying out some parameters... {threshold / 1000 : 5.2%}')
-    accuracy, precision, recall, f1 = test(withheld, threshold, loners)
-
-    if f1 > best_f1:
-        best_f1 = f1
-        best_threshold = threshold
-
-# Here, we will actually test.
-
-accuracy, precision, recall, f1 = test(set(os.listdir()) - withheld, best_threshold, loners)
-print('Threshold:', best_threshold)
-print('Accuracy:', accuracy)
-print('Precision:', precision)
-print('Recall:', recall)
-print('F1:', f1)
-
-# test({'N0777.sgml'}, best_threshold, loners, verbose=True)
+    # test(model, {'N0777.sgml'}, best_threshold, loners, verbose=True)
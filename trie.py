@@ -0,0 +1,135 @@
+from array import array
+from bisect import bisect_left
+from instrumentation import timed
+from vocabulary import pair
+
+# This is a syllable-level trie over a dictionary of words.
+# Syllables are given IDs from 1, so that 0 can stand for a syllable that is in no word, and the nodes are numbered from the root, which is 0.
+# The edges are kept in compressed sparse row form, like the lattices below:
+# the children of node n are children[k] for offsets[n] <= k < offsets[n + 1], sorted by the IDs of their syllables in labels[k],
+# so a child is found by binary search. The root has a child for most syllables, so its children are also in roots, indexed by syllable ID.
+# words[n] is the index of the word that ends at node n in the dictionary, or -1 if no word ends there.
+# This takes a few flat arrays instead of a dict for every node, which is smaller than even a set of the words as strings.
+# Walking the trie one syllable at a time lets us find words in a sentence without building any candidate strings.
+
+class Trie:
+    def __init__(self, words):
+        ids = self.ids = {}
+        word_ids = self.words = array('i', [-1])
+        edges = {}
+
+        for id, word in enumerate(words):
+            syllables = word.split()
+
+            if not syllables:
+                continue
+
+            node = 0
+
+            for syllable in syllables:
+                syllable_id = ids.get(syllable)
+
+                if syllable_id is None:
+                    syllable_id = ids[syllable] = len(ids) + 1
+
+                key = pair(node, syllable_id)
+                child = edges.get(key)
+
+                if child is None:
+                    child = edges[key] = len(word_ids)
+                    word_ids.append(-1)
+
+                node = child
+
+            word_ids[node] = id
+
+        # Here, we will lay the edges out by their parents and then their syllables.
+
+        keys = sorted(edges)
+        self.offsets = array('i', [0] * (len(self.words) + 1))
+
+        for key in keys:
+            self.offsets[(key >> 32) + 1] += 1
+
+        for n in range(len(self.words)):
+            self.offsets[n + 1] += self.offsets[n]
+
+        self.labels = array('i', [key & 0xffffffff for key in keys])
+        self.children = array('i', [edges[key] for key in keys])
+        self.roots = array('i', [-1] * (len(self.ids) + 1))
+
+        for k in range(self.offsets[0], self.offsets[1]):
+            self.roots[self.labels[k]] = self.children[k]
+
+    def encode(self, syllables):
+        return [self.ids.get(syllable, 0) for syllable in syllables]
+
+    # Here, we follow the edge for a syllable ID from a node, returning the child or -1 if there is none.
+
+    def child(self, node, syllable):
+        if node == 0:
+            return self.roots[syllable]
+
+        start, end = self.offsets[node], self.offsets[node + 1]
+        k = bisect_left(self.labels, syllable, start, end)
+        return self.children[k] if k < end and self.labels[k] == syllable else -1
+
+def build_trie(words):
+    return Trie(words)
+
+def read_words(filename, normalize):
+    with open(filename, 'r') as file:
+        return [word for word in map(normalize, file) if word.split()]
+
+def load_trie(filename, normalize):
+    return build_trie(read_words(filename, normalize))
+
+# Here, we extend a word starting at syllables[start] one syllable at a time for as long as the extended word is still in the dictionary.
+# The first syllable is always taken, even if it is not in the dictionary itself.
+# This returns the index just past the end of the word.
+
+@timed('trie')
+def greedy_match(trie, syllables, start):
+    node = trie.roots[trie.ids.get(syllables[start], 0)]
+    end = start + 1
+
+    while node >= 0 and end < len(syllables):
+        node = trie.child(node, trie.ids.get(syllables[end], 0))
+
+        if node < 0 or trie.words[node] < 0:
+            break
+
+        end += 1
+
+    return end
+
+# Here, we find every word in the dictionary that starts at each syllable, walking the trie from each position.
+# The result is a lattice in compressed sparse row form:
+# the words starting at syllables[i] end just before ends[k] and have IDs words[k] for offsets[i] <= k < offsets[i + 1].
+# A single syllable is always a candidate word, with the unknown ID if it is not in the dictionary.
+
+@timed('lattice')
+def build_lattice(trie, syllables, unknown=0):
+    offsets = array('i', [0])
+    ends = array('i')
+    words = array('i')
+    ids = trie.encode(syllables)
+    word_ids = trie.words
+
+    for i in range(len(ids)):
+        node = trie.roots[ids[i]]
+        ends.append(i + 1)
+        words.append(word_ids[node] if node >= 0 and word_ids[node] >= 0 else unknown)
+        j = i + 1
+
+        while node >= 0 and j < len(ids):
+            node = trie.child(node, ids[j])
+            j += 1
+
+            if node >= 0 and word_ids[node] >= 0:
+                ends.append(j)
+                words.append(word_ids[node])
+
+        offsets.append(len(ends))
+
+    return offsets, ends, words
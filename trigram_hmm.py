@@ -0,0 +1,279 @@
+import math
+import os
+from array import array
+import storage
+from chunking import MAX_LENGTH, decode_chunked
+from corpus import read_corpus, read_sgml
+from evaluation import Evaluation
+from instrumentation import progress, timed
+from vocabulary import Vocabulary
+
+# This is a second-order HMM over BIES-tags, following Brants 2000 (TnT).
+# A syllable is tagged B if it begins a word of several syllables, I if it is inside one, E if it ends one, and S if it is a word by itself,
+# and each tag depends on the two tags before it, so the model can tell, say, the second syllable of a two-syllable word from that of a three-syllable word.
+#
+# The tags are numbered so that the statistics can be flat arrays:
+# trigram_counts[16 * t_1 + 4 * t_2 + t_3], bigram_counts[4 * t_2 + t_3], and unigram_counts[t_3] count tag sequences,
+# where each sentence starts with two S tags, as if it came right after a word,
+# and B_counts[4 * o + t] counts the syllable whose ID in the vocabulary is o with tag t.
+#
+# Transitions interpolate the trigram, bigram, and unigram estimates, with weights λ found by deleted interpolation,
+# and emissions P(o | t) are add-α smoothed.
+# Syllables that were never seen in training have ID 0 and get the emissions of the syllables that were seen only once,
+# which are the best guide to how unseen syllables are tagged.
+
+Q = ['B', 'I', 'E', 'S']
+B, I, E, S = range(4)
+
+# These are the tags that can follow each tag. Anything else would not split the sentence into words.
+
+FOLLOWERS = [(I, E), (I, E), (B, S), (B, S)]
+
+# The Viterbi states are pairs of tags 4 * t_1 + t_2. For each state, arcs gives the tag of the state and the two states it can be reached from,
+# with the indices of their transitions in log_A.
+
+STATES = [4 * t_1 + t_2 for t_1 in range(4) for t_2 in FOLLOWERS[t_1]]
+FINAL_STATES = [state for state in STATES if state & 3 in (E, S)]
+arcs = [(state, state & 3, [(4 * t_0 + (state >> 2), 16 * t_0 + state) for t_0 in range(4) if state >> 2 in FOLLOWERS[t_0]]) for state in STATES]
+
+class TrigramHMM:
+    def __init__(self, smoothing=0.1):
+        self.vocabulary = Vocabulary()
+        self.unigram_counts = array('d', [0] * 4)
+        self.bigram_counts = array('d', [0] * 16)
+        self.trigram_counts = array('d', [0] * 64)
+        self.B_counts = array('d', [0] * 4)
+        self.λ = array('d', [0, 0, 1])
+        self.log_A = array('d', [-math.inf] * 64)
+        self.log_B = array('d', [-math.inf] * 4)
+        self.smoothing = array('d', [smoothing])
+
+    def train(self, syllables, actual_boundaries):
+        tags = to_tags(actual_boundaries) if syllables else []
+        t_1, t_2 = S, S
+
+        for syllable, t_3 in zip(syllables, tags):
+            self.unigram_counts[t_3] += 1
+            self.bigram_counts[4 * t_2 + t_3] += 1
+            self.trigram_counts[16 * t_1 + 4 * t_2 + t_3] += 1
+            o = self.vocabulary.add(syllable)
+
+            if 4 * o == len(self.B_counts):
+                self.B_counts.extend((0, 0, 0, 0))
+
+            self.B_counts[4 * o + t_3] += 1
+            t_1, t_2 = t_2, t_3
+
+    # Here, we will convert the counts to log probabilities.
+    # Every emission depends on the total count of its tag, so unlike the first-order HMM, the whole of B is recomputed each time.
+
+    def estimate(self):
+        unigram_counts, bigram_counts, trigram_counts = self.unigram_counts, self.bigram_counts, self.trigram_counts
+        N = sum(unigram_counts)
+        bigram_totals = [sum(bigram_counts[4 * t_2:4 * t_2 + 4]) for t_2 in range(4)]
+        trigram_totals = [sum(trigram_counts[4 * h:4 * h + 4]) for h in range(16)]
+
+        # Here, each trigram votes, with its count, for whichever estimate predicts it best when it is left out of the counts.
+
+        λ = [0, 0, 0]
+
+        for h in range(16):
+            for t_3 in range(4):
+                count = trigram_counts[4 * h + t_3]
+
+                if count:
+                    t_2 = h & 3
+                    estimates = [
+                        (unigram_counts[t_3] - 1) / (N - 1) if N > 1 else 0,
+                        (bigram_counts[4 * t_2 + t_3] - 1) / (bigram_totals[t_2] - 1) if bigram_totals[t_2] > 1 else 0,
+                        (count - 1) / (trigram_totals[h] - 1) if trigram_totals[h] > 1 else 0
+                    ]
+                    λ[estimates.index(max(estimates))] += count
+
+        total = sum(λ)
+
+        if total:
+            self.λ = array('d', [weight / total for weight in λ])
+
+        λ_1, λ_2, λ_3 = self.λ
+
+        for h in range(16):
+            t_1, t_2 = h >> 2, h & 3
+
+            if t_2 not in FOLLOWERS[t_1]:
+                continue
+
+            for t_3 in FOLLOWERS[t_2]:
+                probability = λ_1 * (unigram_counts[t_3] / N if N else 0)
+                probability += λ_2 * (bigram_counts[4 * t_2 + t_3] / bigram_totals[t_2] if bigram_totals[t_2] else 0)
+                probability += λ_3 * (trigram_counts[4 * h + t_3] / trigram_totals[h] if trigram_totals[h] else 0)
+                self.log_A[4 * h + t_3] = log(probability)
+
+        # Here, the syllables seen once stand in for the unknown syllable, before smoothing.
+
+        α = self.smoothing[0]
+        V = len(self.vocabulary)
+        B_counts = self.B_counts
+
+        for o in range(1, V):
+            if sum(B_counts[4 * o:4 * o + 4]) == 1:
+                for t in range(4):
+                    B_counts[t] += B_counts[4 * o + t]
+
+        denominators = [math.log(unigram_counts[t] + α * V) for t in range(4)]
+        self.log_B = array('d', [math.log(B_counts[i] + α) - denominators[i & 3] for i in range(len(B_counts))])
+
+        for t in range(4):
+            B_counts[t] = 0
+
+    # Here, we add more annotated SGML files to a trained model.
+
+    def update(self, filenames):
+        for name in ('unigram_counts', 'bigram_counts', 'trigram_counts', 'B_counts', 'λ', 'log_A', 'log_B', 'smoothing'):
+            setattr(self, name, storage.thaw(getattr(self, name)))
+
+        for syllables, actual_boundaries in read_corpus(filenames):
+            self.train(syllables, actual_boundaries)
+
+        self.estimate()
+
+    # Here, we will posit BIES-tags using the Viterbi algorithm in log space over the pairs of tags.
+    # Only the 8 pairs of tags that can follow each other are states, and each state can only be reached from 2 others,
+    # so each syllable takes 16 additions and 8 comparisons, which the precomputed arcs lay out as one flat loop.
+    # That loop is the whole of what a pass vectorized over the states would do, and vectorizing it or batching sentences would need an array library,
+    # which this project does not depend on, so like hmm.HMM there is no batched decoder.
+    # backpointer[16 * t + state] is the best previous state for a state at time t.
+    # Long inputs are decoded in chunks of at most MAX_LENGTH syllables, each of which starts a word,
+    # so they are split before syllables that are more likely to start a word than not where possible.
+
+    @timed('decoding')
+    def decode(self, syllables):
+        if len(syllables) > MAX_LENGTH:
+            return decode_chunked(self.decode, syllables, self.break_costs, tags=True)
+
+        log_A, log_B = self.log_A, self.log_B
+        observations = self.vocabulary.encode(syllables)
+        T = len(observations)
+
+        if T == 0:
+            return []
+
+        o = 4 * observations[0]
+        viterbi = [-math.inf] * 16
+
+        for t in FOLLOWERS[S]:
+            viterbi[4 * S + t] = log_A[16 * S + 4 * S + t] + log_B[o + t]
+
+        backpointer = bytearray(16 * T)
+
+        for time in range(1, T):
+            o = 4 * observations[time]
+            next_viterbi = [-math.inf] * 16
+            offset = 16 * time
+
+            for state, t, ((previous_0, a_0), (previous_1, a_1)) in arcs:
+                from_0 = viterbi[previous_0] + log_A[a_0]
+                from_1 = viterbi[previous_1] + log_A[a_1]
+
+                if from_1 >= from_0:
+                    next_viterbi[state] = from_1 + log_B[o + t]
+                    backpointer[offset + state] = previous_1
+
+                else:
+                    next_viterbi[state] = from_0 + log_B[o + t]
+                    backpointer[offset + state] = previous_0
+
+            viterbi = next_viterbi
+
+        state = max(FINAL_STATES, key=lambda state: viterbi[state])
+        bestpath = [None] * T
+
+        for time in range(T - 1, -1, -1):
+            bestpath[time] = Q[state & 3]
+            state = backpointer[16 * time + state] if time else state
+
+        return bestpath
+
+    def break_costs(self, syllables, start, end):
+        log_B = self.log_B
+        return [0] + [0 if max(log_B[4 * o + B], log_B[4 * o + S]) >= max(log_B[4 * o + I], log_B[4 * o + E]) else 1 for o in self.vocabulary.encode(syllables[start + 1:end + 1])]
+
+    def save(self, filename):
+        storage.save(filename, 'trigram_hmm', {
+            'vocabulary': self.vocabulary,
+            'unigram_counts': self.unigram_counts,
+            'bigram_counts': self.bigram_counts,
+            'trigram_counts': self.trigram_counts,
+            'B_counts': self.B_counts,
+            'λ': self.λ,
+            'log_A': self.log_A,
+            'log_B': self.log_B,
+            'smoothing': self.smoothing
+        })
+
+    @classmethod
+    def load(cls, filename):
+        model = cls()
+
+        for name, section in storage.load(filename, 'trigram_hmm').items():
+            setattr(model, name, section)
+
+        return model
+
+# Here, we convert between word boundaries and BIES-tags.
+
+def to_tags(boundaries):
+    tags = []
+    begins = True
+
+    for boundary in [*boundaries, 1]:
+        if boundary:
+            tags.append(S if begins else E)
+
+        else:
+            tags.append(B if begins else I)
+
+        begins = bool(boundary)
+
+    return tags
+
+def to_boundaries(tags):
+    return [1 if tag in ('E', 'S') else 0 for tag in tags[:-1]]
+
+def log(probability):
+    return math.log(probability) if probability > 0 else -math.inf
+
+if __name__ == '__main__':
+    # First, we will train, unless there is already a trained model.
+
+    model_filename = os.path.abspath('trigram_hmm.model')
+    os.chdir('EVBCorpus_EVBNews_v2.0')
+    n = 750 # This is where to draw the line between training and test data.
+
+    if not os.path.exists(model_filename):
+        model = TrigramHMM()
+
+        for training_number in range(1, n):
+            progress(f'Training... {training_number / n : 5.2%}')
+
+            for syllables, actual_boundaries in read_sgml(f'N{training_number:04d}.sgml', cache=True):
+                model.train(syllables, actual_boundaries)
+
+        model.estimate()
+        model.save(model_filename)
+
+    model = TrigramHMM.load(model_filename)
+
+    # Now, we will test.
+
+    evaluation = Evaluation()
+
+    for test_number in range(n, 1001):
+        progress(f'Testing... {(test_number - n) / (1001 - n) : 5.2%}')
+
+        filename = f'N{test_number:04d}.sgml'
+
+        for syllables, actual_boundaries in read_sgml(filename, cache=True):
+            evaluation.add(actual_boundaries, to_boundaries(model.decode(syllables)), filename, len(syllables))
+
+    evaluation.print()
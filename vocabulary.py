@@ -0,0 +1,58 @@
+import sys
+
+# This maps tokens (syllables or words) to dense integer IDs, so that models can keep their statistics in flat arrays indexed by ID
+# instead of in dicts keyed by strings.
+# ID 0 is reserved for unknown tokens, so looking up a token that was never added never fails and never adds anything.
+
+UNKNOWN = 0
+
+class Vocabulary:
+    def __init__(self, tokens=()):
+        self.ids = {}
+        self.tokens = []
+        self.add('<unk>')
+
+        for token in tokens:
+            self.add(token)
+
+    # Here, we rebuild a vocabulary from its list of tokens, which must start with the unknown token.
+
+    @classmethod
+    def from_tokens(cls, tokens):
+        vocabulary = cls.__new__(cls)
+        vocabulary.tokens = tokens
+        vocabulary.ids = dict(zip(tokens, range(len(tokens))))
+        return vocabulary
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def __contains__(self, token):
+        return token in self.ids
+
+    def __getitem__(self, id):
+        return self.tokens[id]
+
+    def add(self, token):
+        id = self.ids.get(token)
+
+        if id is None:
+            token = sys.intern(token)
+            id = self.ids[token] = len(self.tokens)
+            self.tokens.append(token)
+
+        return id
+
+    def get(self, token):
+        return self.ids.get(token, UNKNOWN)
+
+    def encode(self, tokens):
+        return [self.ids.get(token, UNKNOWN) for token in tokens]
+
+# Here, we pack a pair of IDs into a single int, which is much smaller than a tuple of strings as a dict key.
+
+def pair(first, second):
+    return first << 32 | second
+
+def unpair(key):
+    return key >> 32, key & 0xffffffff